@@ -7,6 +7,8 @@ import logging
 
 from seqkit.stat import stat, stat_args
 from seqkit.split import split, split_args
+from seqkit.faidx import faidx, faidx_args
+from seqkit.benchmark import benchmark, benchmark_args
 from seqkit import __author__, __version__, __email__
 
 
@@ -37,6 +39,14 @@ contact:  %s <%s>\
     parser_split = split_args(parser_split)
     parser_split.set_defaults(func=split)
 
+    parser_faidx = subparsers.add_parser('faidx', help="Index fasta and extract sequences")
+    parser_faidx = faidx_args(parser_faidx)
+    parser_faidx.set_defaults(func=faidx)
+
+    parser_benchmark = subparsers.add_parser('benchmark', help="Benchmark on synthetic datasets")
+    parser_benchmark = benchmark_args(parser_benchmark)
+    parser_benchmark.set_defaults(func=benchmark)
+
     return args.parse_args()
 
 
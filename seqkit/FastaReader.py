@@ -1,7 +1,12 @@
 
-import gzip
+import mmap
 import logging
 import os.path
+from array import array
+from collections import OrderedDict
+
+from seqkit.stream import BLOCK_SIZE, READ_AHEAD_DEPTH, READ_AHEAD_SIZE, open_stream, binary_stream, read_blocks, \
+    sync_blocks, STDIN, is_pipe, sniff_pipe
 
 LOG = logging.getLogger(__name__)
 ALLOWED_FASTA = [".fa", ".fasta", ".fa.gz", ".fasta.gz"]
@@ -23,26 +28,38 @@ def split_header(name):
 
 class FastaRecord(object):
     """
-    object to process a fasta record
+    object to process a fasta record, the id and description are split
+    and the data is checked on first access
     """
+    __slots__ = ("_name", "_seq", "_id", "_description", "_checked")
     DELIMITER = ">"
 
     def __init__(self, name, seq):
+        self._name = name
+        self._seq = seq
+        self._id = None
+        self._description = None
+        self._checked = False
+
+    def _check(self):
+        if self._checked:
+            return
+
         try:
-            assert "\n" not in name
-            assert "\n" not in seq
-            assert self.DELIMITER not in seq
-            self._name = name
-            self._seq = seq
-            self._id, self._description = split_header(name)
+            assert "\n" not in self._name
+            assert "\n" not in self._seq
+            assert self.DELIMITER not in self._seq
         except AssertionError:
             raise ValueError("Invalid FASTA record data")
 
+        self._checked = True
+
     @property
     def name(self):
         """
         the name of the seq, strings after ">"
         """
+        self._check()
         return self._name
 
     @property
@@ -51,6 +68,8 @@ class FastaRecord(object):
         The id of the seq, equal to the FASTA header
         up to the first whitespace.
         """
+        if self._id is None:
+            self._id, self._description = split_header(self.name)
         return self._id
 
     @property
@@ -59,6 +78,8 @@ class FastaRecord(object):
         The description of the seq in the FASTA file, equal to
         the contents of the FASTA header following the first whitespace
         """
+        if self._description is None:
+            self._id, self._description = split_header(self.name)
         return self._description
 
     @property
@@ -67,6 +88,7 @@ class FastaRecord(object):
         The seq of the record
 
         """
+        self._check()
         return self._seq
 
     @classmethod
@@ -109,6 +131,11 @@ def check_format(filename):
     :return:
     """
 
+    if is_pipe(filename):
+        if sniff_pipe(filename)[1] == "fasta":
+            return 0
+        raise Exception("%r is not a fasta stream" % filename)
+
     if any([f for f in ALLOWED_FASTA if filename.endswith(f)]):
         return 0
     else:
@@ -116,45 +143,511 @@ def check_format(filename):
         raise Exception(msg)
 
 
+def find_header(block, pos=0):
+    """
+    find the start of the next fasta header line in block
+    :param block: bytes
+    :param pos: the position to search from
+    :return: the position of ">" or -1
+    """
+    pos = block.find(b"\n>", pos)
+
+    if pos >= 0:
+        pos += 1
+
+    return pos
+
+
+def count_spaces(block, start, end):
+    """
+    count the newlines and spaces in block[start:end], which are not bases
+    """
+    return sum(block.count(i, start, end) for i in (b"\n", b"\r", b" ", b"\t"))
+
+
+def check_length(length):
+    """
+    a record without sequence is invalid, as FastaRecord.from_string
+    """
+    if not length:
+        raise ValueError("Invalid fasta record without sequence")
+
+    return length
+
+
+def find_record_start(fh, offset):
+    """
+    find the offset of the first fasta record at or after offset
+    :param fh: a binary file object
+    :param offset:
+    :return:
+    """
+    end = offset
+    last = b""  # the last byte of the previous block
+
+    for start, block, eof in sync_blocks(fh, offset):
+        if block[:1] == b">" and (last == b"\n" or start == offset == 0):
+            return start
+
+        pos = find_header(block)
+
+        if pos >= 0:
+            return start + pos
+
+        last = block[-1:]
+        end = start + len(block)
+
+    return end
+
+
+def read_fasta_chunks(stream, size=BLOCK_SIZE):
+    """
+    yield the raw bytes of each fasta record from a binary stream,
+    record boundaries are found with bytes.find on large blocks
+    :param stream: a binary stream object
+    :param size: the size of blocks read from stream
+    :return:
+    """
+    pieces = []
+    at_line_start = True
+
+    for block in read_blocks(stream, size):
+        view = memoryview(block)
+        start = 0
+
+        if at_line_start and block[:1] == b">":
+            pos = 0
+        else:
+            pos = find_header(block)
+
+        while pos >= 0:
+            if pos > start:
+                pieces.append(view[start:pos])
+            if pieces:
+                yield join_pieces(pieces)
+
+            start = pos
+            pos = find_header(block, pos + 1)
+
+        if start < len(block):
+            pieces.append(view[start:])
+        at_line_start = block.endswith(b"\n")
+
+    if pieces:
+        yield join_pieces(pieces)
+
+
+def join_pieces(pieces):
+    """
+    join the pieces of a record and empty the list, so that the blocks
+    under the pieces are not kept while the record is used
+    :param pieces: list of memoryview
+    :return: bytes
+    """
+    chunk = b"".join(pieces)
+    del pieces[:]
+    return chunk
+
+
+def check_fasta_chunk(chunk):
+    """
+    check the raw bytes of a fasta record read by read_fasta_chunks
+    :param chunk: bytes of a record, or the data before the first record
+    :return: length of sequence, None for the blank data before the first record
+    """
+    if chunk[:1] != b">":
+        if chunk.strip():
+            raise ValueError("Invalid fasta, data before the first record")
+        return None
+
+    start = chunk.find(b"\n") + 1
+
+    if not start or chunk.find(b">", start) >= 0:
+        raise ValueError("Invalid fasta record %r" % get_chunk_id(chunk))
+
+    return check_length(len(chunk) - start - count_spaces(chunk, start, len(chunk)))
+
+
+def yield_fasta_raw(stream, size=BLOCK_SIZE):
+    """
+    yield the original bytes of fasta records from a binary stream
+    :param stream: a binary stream object
+    :param size: the size of blocks read from stream
+    :return: (bytes of record, length of sequence)
+    """
+    for chunk in read_fasta_chunks(stream, size):
+        length = check_fasta_chunk(chunk)
+
+        if length is None:
+            continue
+
+        if not chunk.endswith(b"\n"):
+            chunk += b"\n"
+
+        yield chunk, length
+
+
+def get_chunk_id(chunk):
+    """
+    get the id of record from the raw bytes of record
+    :param chunk: bytes start with ">"
+    :return:
+    """
+    end = chunk.find(b"\n")
+    return bytes(chunk[1:end]).split(None, 1)[0].decode()
+
+
+def parse_fasta_chunk(chunk):
+    """
+    build a fasta record from the raw bytes of a record
+    :param chunk: bytes start with ">"
+    :return: FastaRecord
+    """
+    if chunk[:1] != b">":
+        if chunk.strip():
+            raise ValueError("String not recognized as a valid FASTA record")
+        return None
+
+    end = chunk.find(b"\n")
+
+    if end < 0:
+        end = len(chunk)
+
+    seq = chunk[end+1:].translate(None, b" \t\r\n")
+
+    if not seq:
+        raise ValueError("String not recognized as a valid FASTA record")
+
+    return FastaRecord(chunk[1:end].strip().decode(), seq.decode("latin-1"))
+
+
 def yield_fasta_records(stream):
     """
-    yield fastq records from stream
-    :param stream: a stream object
+    yield fasta records from stream, a binary stream or a text file with a
+    binary buffer is read in blocks, other text streams(e.g. io.StringIO)
+    and iterables of text lines are read line by line
+    :param stream: a stream object or an iterable of lines
+    :return:
+    """
+    stream = binary_stream(stream)
+
+    if not hasattr(stream, "read") or isinstance(stream.read(0), str):
+        return yield_fasta_line_records(stream)
+
+    return yield_fasta_block_records(stream)
+
+
+def yield_fasta_line_records(lines):
+    """
+    yield fasta records from text lines
+    :param lines: an iterable of str
     :return:
     """
-    string = ""
+    record = []
 
-    for line in stream:
+    for line in lines:
         line = line.strip()
 
         if not line:
             continue
 
-        if string and line.startswith(">"):
-            yield FastaRecord.from_string(string)
-            string = ""
+        if record and line.startswith(">"):
+            yield FastaRecord.from_string("\n".join(record))
+            record = []
 
-        string += "%s\n" % line
+        record.append(line)
 
-    if string:
-        yield FastaRecord.from_string(string)
+    if record:
+        yield FastaRecord.from_string("\n".join(record))
 
 
-def open_fasta(filename):
+def yield_fasta_block_records(stream):
+    """
+    yield fasta records from a binary stream, record boundaries are found in large blocks
+    :param stream: a binary stream object
+    :return:
+    """
+    for chunk in read_fasta_chunks(stream):
+        record = parse_fasta_chunk(chunk)
+
+        if record is not None:
+            yield record
+
+
+def yield_fasta_lengths(stream, size=BLOCK_SIZE):
+    """
+    yield the sequence lengths of fasta records from a binary stream,
+    one array per block, without building records
+    :param stream: a binary stream object
+    :param size: the size of blocks read from stream
+    :return: arrays of lengths
+    """
+    length = None
+    in_header = False
+    at_line_start = True
+
+    for block in read_blocks(stream, size):
+        lengths = array("Q")
+        end = len(block)
+        pos = 0
+
+        while True:
+            if in_header:
+                pos = block.find(b"\n", pos) + 1
+                if pos == 0:
+                    break
+                in_header = False
+
+            if pos == 0 and at_line_start and block[:1] == b">":
+                header = 0
+            else:
+                header = find_header(block, max(pos - 1, 0))
+
+            stop = end if header < 0 else header
+
+            if length is not None:
+                length += stop - pos - count_spaces(block, pos, stop)
+                if block.find(b">", pos, stop) >= 0:
+                    raise ValueError("Invalid fasta record, '>' inside the sequence")
+            elif block[pos:stop].strip():
+                raise ValueError("Invalid fasta, data before the first record")
+
+            if header < 0:
+                break
+
+            if length is not None:
+                lengths.append(check_length(length))
+
+            length = 0
+            in_header = True
+            pos = header + 1
+
+        at_line_start = block.endswith(b"\n")
+
+        if lengths:
+            yield lengths
+
+    if length is not None:
+        yield array("Q", [check_length(length)])
+
+
+def scan_lengths(filename, start=0, end=None):
+    """
+    read fasta file and return the lengths of records
+    :param filename:
+    :param start: the start offset of records, see find_record_start
+    :param end: the end offset of records
+    :return: array('Q') of lengths
+    """
+    check_format(filename)
+    if filename != STDIN:
+        filename = os.path.abspath(filename)
+    r = array("Q")
+
+    LOG.info("Scan fasta lengths from %r" % filename)
+
+    with open_stream(filename, start, end) as stream:
+        for lengths in yield_fasta_lengths(stream):
+            r.extend(lengths)
+
+    return r
+
+
+def open_fasta(filename, start=0, end=None, read_ahead=READ_AHEAD_DEPTH, size=READ_AHEAD_SIZE):
     """
     read fasta file and return fasta records
     :param filename:
+    :param start: the start offset of records, see find_record_start
+    :param end: the end offset of records
+    :param read_ahead: the number of blocks read ahead in a thread, see open_stream
+    :param size: the size of blocks read ahead
     :return:
     """
     check_format(filename)
-    filename = os.path.abspath(filename)
-    mode = 'r'
+    if filename != STDIN:
+        filename = os.path.abspath(filename)
 
     LOG.info("Parse fasta sequences from %r" % filename)
 
-    if filename.endswith(".gz"):
-        stream = gzip.open(filename, mode)
-    else:
-        stream = open(filename, mode)
+    return yield_fasta_records(open_stream(filename, start, end, read_ahead, size))
+
+
+class FastaIndex(object):
+    """
+    samtools-compatible index of a fasta file (.fai), sequences are
+    served from the mmap of the uncompressed file
+    """
+    def __init__(self, filename, fai=None):
+        self.filename = os.path.abspath(filename)
+        self.fai = fai or self.filename + ".fai"
+        self._records = OrderedDict()
+        # the length of each line of .fai, a .fai not built here may repeat a name
+        self._lengths = array("Q")
+        self._fh = None
+        self._mmap = None
+
+        with open(self.fai) as fh:
+            for line in fh:
+                line = line.strip()
+                if not line:
+                    continue
+                name, length, offset, linebases, linewidth = line.split("\t")[:5]
+                self._records[name] = (int(length), int(offset), int(linebases), int(linewidth))
+                self._lengths.append(int(length))
+
+    @classmethod
+    def build(cls, filename, fai=None):
+        """
+        build the .fai of a fasta file, a name can be indexed only once as samtools
+        :param filename:
+        :param fai: the index file, default is {filename}.fai
+        :return: FastaIndex
+        """
+        check_format(filename)
+        filename = os.path.abspath(filename)
+        fai = fai or filename + ".fai"
+        offset = 0
+        names = set()
+
+        if filename.endswith(".gz"):
+            raise Exception("%r is compressed, only uncompressed fasta can be indexed" % filename)
+
+        LOG.info("Build fasta index %r" % fai)
+
+        try:
+            with open(filename, "rb") as stream, open(fai + ".tmp", "w") as out:
+                for chunk in read_fasta_chunks(stream):
+                    if chunk[:1] == b">":
+                        line = index_fasta_chunk(chunk, offset)
+                        if line[0] in names:
+                            raise ValueError("Duplicate sequence %r in %r can not be indexed" % (line[0], filename))
+                        names.add(line[0])
+                        out.write("%s\t%s\t%s\t%s\t%s\n" % line)
+                    offset += len(chunk)
+        except Exception:
+            os.remove(fai + ".tmp")
+            raise
+
+        os.rename(fai + ".tmp", fai)
+
+        return cls(filename, fai)
+
+    def __contains__(self, name):
+        return name in self._records
+
+    def __iter__(self):
+        return iter(self._records)
+
+    def __len__(self):
+        return len(self._records)
+
+    def lengths(self):
+        """
+        return the lengths of sequences in file order, one for each line of .fai
+        :return: array('Q')
+        """
+        return array("Q", self._lengths)
+
+    def length(self, name):
+        return self._records[name][0]
+
+    def fetch(self, name, start=0, end=None):
+        """
+        get the sub sequence seq[start:end] of a record, a slice in one line
+        is a memoryview of the mmap without copy, which must be released
+        before close; a slice over lines is copied once without newlines
+        :param name: the id of record
+        :param start: 0-based start
+        :param end: 0-based end, exclusive
+        :return: memoryview or bytes
+        """
+        if name not in self._records:
+            raise KeyError("%r is not in %r" % (name, self.fai))
+
+        length, offset, linebases, linewidth = self._records[name]
+        end = length if end is None else min(end, length)
+        start = max(start, 0)
+
+        if start >= end:
+            return b""
+
+        if self._mmap is None:
+            self._fh = open(self.filename, "rb")
+            self._mmap = mmap.mmap(self._fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+        first = offset + start // linebases * linewidth + start % linebases
+        last = offset + (end - 1) // linebases * linewidth + (end - 1) % linebases + 1
+
+        if start // linebases == (end - 1) // linebases:
+            return memoryview(self._mmap)[first:last]
+
+        return self._mmap[first:last].translate(None, b"\r\n")
+
+    def get(self, name, start=0, end=None):
+        """
+        get the sub sequence seq[start:end] of a record
+        :param name: the id of record
+        :param start: 0-based start
+        :param end: 0-based end, exclusive
+        :return: str
+        """
+        return str(self.fetch(name, start, end), "latin-1")
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._fh.close()
+            self._mmap = self._fh = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def index_fasta_chunk(chunk, offset):
+    """
+    get the .fai line of the raw bytes of a record, lines of a sequence
+    must have the same length except the last one
+    :param chunk: bytes start with ">"
+    :param offset: the offset of chunk in file
+    :return: (name, length, offset, linebases, linewidth)
+    """
+    end = chunk.find(b"\n")
+    if end < 0:
+        end = len(chunk)
+
+    name = chunk[1:end].split(None, 1)[0].decode()
+    seq = chunk[end+1:].rstrip(b"\r\n")
+    offset += end + 1
+
+    linewidth = seq.find(b"\n") + 1
+
+    if linewidth == 0:  # one line
+        linebases = len(seq.rstrip(b"\r"))
+        return name, linebases, offset, linebases, linebases + 1
+
+    linebases = len(seq[:linewidth].rstrip(b"\r\n"))
+    # every line but the last one ends at a multiple of linewidth
+    ends = seq[linewidth-1::linewidth]
+
+    if ends.count(b"\n") != len(ends) or seq.count(b"\n") != len(ends):
+        raise ValueError("Different line length in sequence %r" % name)
+
+    length = len(seq) - len(ends) * (linewidth - linebases)
+
+    return name, length, offset, linebases, linewidth
+
+
+def has_index(filename):
+    """
+    check whether the .fai of a fasta file exists and is up to date
+    :param filename:
+    :return:
+    """
+    if is_pipe(filename):
+        return False
 
-    return yield_fasta_records(stream)
+    fai = filename + ".fai"
+    return os.path.exists(fai) and os.path.getmtime(fai) >= os.path.getmtime(filename)
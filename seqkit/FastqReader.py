@@ -1,21 +1,32 @@
 
-import gzip
+import io
+import bisect
 import logging
 import os.path
+from array import array
+from itertools import repeat
+
+from seqkit.bgzf import BgzfReader, is_bgzf
+from seqkit.stream import BLOCK_SIZE, READ_AHEAD_DEPTH, READ_AHEAD_SIZE, SYNC_SIZE, open_stream, read_blocks, \
+    sync_blocks, STDIN, is_pipe, sniff_pipe
 
 LOG = logging.getLogger(__name__)
 ALLOWED_FASTQ = [".fq", ".fastq", ".fq.gz", ".fastq.gz"]
+WHITESPACES = (b" ", b"\t", b"\r")
 
 
 class FastqRecord(object):
     """
-    Object to process a fastq record
+    Object to process a fastq record, the id is split on first access
     """
+    __slots__ = ("_description", "_seq", "_desc2", "_quality", "_id")
+
     def __init__(self, description, seq, desc2, quality):
         self._description = description[1:]
         self._seq = seq
         self._desc2 = desc2
         self._quality = quality
+        self._id = None
 
     @property
     def identifier(self):
@@ -32,7 +43,9 @@ class FastqRecord(object):
         up to the first whitespace.
         :return:
         """
-        return self._description.split()[0]
+        if self._id is None:
+            self._id = self._description.split()[0]
+        return self._id
 
     @property
     def seq(self):
@@ -84,6 +97,11 @@ def check_format(filename):
     :return:
     """
 
+    if is_pipe(filename):
+        if sniff_pipe(filename)[1] == "fastq":
+            return 0
+        raise Exception("%r is not a fastq stream" % filename)
+
     if any([f for f in ALLOWED_FASTQ if filename.endswith(f)]):
         return 0
     else:
@@ -91,6 +109,62 @@ def check_format(filename):
         raise Exception(msg)
 
 
+def is_record_start(lines):
+    """
+    check whether 4 lines are a fastq record; a quality line may also start
+    with "@", but then the 3rd line is a sequence and never starts with "+"
+    :param lines: 4 lines
+    :return:
+    """
+    return lines[0].startswith(b"@") and lines[2].startswith(b"+") and \
+        len(lines[1].rstrip()) == len(lines[3].rstrip())
+
+
+def find_record_start(fh, offset):
+    """
+    find the offset of the first fastq record at or after offset
+    :param fh: a binary file object
+    :param offset:
+    :return:
+    """
+    end = offset
+    lines = []  # the complete lines not checked yet
+    offsets = []  # the offsets of lines
+    pieces = []  # the pieces of the partial line at the end of blocks
+    pos = None  # the offset of the partial line
+    skip = offset != 0  # the first line starts before offset
+
+    for start, block, eof in sync_blocks(fh, offset):
+        if pos is None:
+            pos = start
+        end = start + len(block)
+        parts = block.split(b"\n")
+
+        if len(parts) == 1 and not eof:
+            pieces.append(block)
+            continue
+
+        # the first part ends the partial line, the last one starts a new line
+        if pieces:
+            parts[0] = b"".join(pieces) + parts[0]
+        pieces = [] if eof else [parts.pop()]
+
+        for line in parts:
+            lines.append(line)
+            offsets.append(pos)
+            pos += len(line) + 1
+
+        for i in range(len(lines) - 3):
+            if not skip and is_record_start(lines[i:i+4]):
+                return offsets[i]
+            skip = False
+
+        # the last 3 lines are checked with the lines of next block
+        del lines[:-3], offsets[:-3]
+
+    return end
+
+
 def yield_fastq_records(stream):
     """
     yield fastq records from stream
@@ -98,40 +172,462 @@ def yield_fastq_records(stream):
     :return:
     """
 
-    n = 0
-    string = ""
+    lines = []
 
     for line in stream:
         line = line.strip()
 
-        if not line:
+        # blank lines between records, an empty read has a blank sequence and quality
+        if not line and not lines:
             continue
 
-        n += 1
-        string += "%s\n" % line
+        lines.append(line)
+
+        if len(lines) == 4:
+            # the same checks as FastqRecord.from_string without joining lines
+            assert lines[0].startswith("@")
+            assert lines[2].startswith("+")
+
+            yield FastqRecord(*lines)
+            lines = []
+
+
+def get_raw_length(record):
+    """
+    check the original bytes of a fastq record, see check_fastq_lines
+    :param record: bytes of 4 lines
+    :return: the length of sequence, ValueError if the record is invalid
+    """
+    lines = strip_lines(bytes(record).split(b"\n"))
+
+    if len(lines) != 4 or not is_record_start(lines) or len(lines[1]) != len(lines[3]):
+        raise ValueError("Invalid fastq record %r" % bytes(record).decode("utf-8", "replace"))
 
-        if n == 4:
-            yield FastqRecord.from_string(string)
-            n = 0
-            string = ""
+    return len(lines[1])
 
 
-def open_fastq(filename):
+def yield_fastq_raw(stream, size=BLOCK_SIZE):
+    """
+    yield the original bytes of fastq records from a binary stream, each
+    record is checked as check_fastq_lines before it is yielded
+    :param stream: a binary stream object
+    :param size: the size of blocks read from stream
+    :return: (bytes of record, length of sequence)
+    """
+    rest = b""
+
+    for block in read_blocks(stream, size):
+        if rest:
+            block = rest + block
+
+        view = memoryview(block)
+        start = 0
+
+        while True:
+            while block[start:start+1] in (b"\n", b"\r", b" ", b"\t"):  # blank lines
+                start += 1
+
+            seq = block.find(b"\n", start) + 1
+            plus = block.find(b"\n", seq) + 1 if seq else 0
+            qual = block.find(b"\n", plus) + 1 if plus else 0
+            end = block.find(b"\n", qual) + 1 if qual else 0
+
+            if not end:
+                break
+
+            length = plus - seq - 1
+
+            # records with "\r" or spaces around the sequence are stripped and checked again
+            if block[start:start+1] != b"@" or block[plus:plus+1] != b"+" or end - qual != plus - seq or \
+                    block[plus-2:plus-1] in WHITESPACES or block[seq:seq+1] in WHITESPACES:
+                length = get_raw_length(view[start:end])
+
+            yield view[start:end], length
+            start = end
+
+        rest = block[start:]
+
+    if rest.strip():
+        lines = strip_lines(split_last_lines(rest))
+        if len(lines) < 4:
+            LOG.warning("The last fastq record is truncated")
+        else:
+            yield rest + b"\n", get_raw_length(rest)
+
+
+def check_fastq_lines(lines):
+    """
+    check complete 4-line records: the 1st line starts with "@", the 3rd line
+    starts with "+" and the sequence is as long as the quality
+    :param lines: the lines of records, a multiple of 4
+    :return: array of the lengths of sequences, ValueError if any record is invalid
+    """
+    lengths = array("Q", map(len, lines[1::4]))
+
+    if all(map(bytes.startswith, lines[0::4], repeat(b"@"))) and \
+            all(map(bytes.startswith, lines[2::4], repeat(b"+"))) and \
+            lengths == array("Q", map(len, lines[3::4])):
+        return lengths
+
+    for i in range(0, len(lines), 4):
+        if not is_record_start(lines[i:i+4]):
+            raise ValueError("Invalid fastq record %r" % b"\n".join(lines[i:i+4]).decode("utf-8", "replace"))
+
+    return lengths
+
+
+def strip_lines(lines):
+    """
+    strip lines and remove the blank lines between records, as yield_fastq_raw
+    skips them; the blank sequence and quality of an empty read are kept
+    :param lines: lines starting at a record
+    :return:
+    """
+    r = []
+
+    for line in map(bytes.strip, lines):
+        if line or len(r) % 4:
+            r.append(line)
+
+    return r
+
+
+def split_last_lines(data):
+    """
+    split the data at the end of file into lines, the blank after the last
+    newline is not a line: an empty read needs the newline of its quality
+    """
+    lines = data.split(b"\n")
+
+    if not lines[-1].strip():
+        lines.pop()
+
+    return lines
+
+
+def yield_fastq_lines(stream, size=BLOCK_SIZE):
+    """
+    yield the lines of complete fastq records from a binary stream, one
+    list per block; lines are split once per block and the records are
+    checked in bulk, blocks with blank lines or spaces around the
+    sequence are stripped line by line as yield_fastq_records does
+    :param stream: a binary stream object
+    :param size: the size of blocks read from stream
+    :return: (lines of records, array of the lengths of sequences)
+    """
+    rest = b""
+
+    for block in read_blocks(stream, size):
+        if rest:
+            block = rest + block
+        if b"\r" in block:
+            block = block.replace(b"\r", b"")
+
+        lines = block.split(b"\n")
+        rest = lines.pop()
+        n = len(lines) // 4 * 4
+        seqs = b"".join(lines[1:n:4])
+
+        if b"" in lines or b" " in seqs or b"\t" in seqs:
+            lines = strip_lines(lines)
+            n = len(lines) // 4 * 4
+
+        try:
+            lengths = check_fastq_lines(lines[:n])
+        except ValueError:
+            # e.g. a line of spaces, check the stripped lines again
+            lines = strip_lines(lines)
+            n = len(lines) // 4 * 4
+            lengths = check_fastq_lines(lines[:n])
+
+        # the lines of an incomplete record are read again with the next block
+        if n < len(lines):
+            rest = b"\n".join(lines[n:] + [rest])
+
+        if lengths:
+            yield lines[:n], lengths
+
+    lines = strip_lines(split_last_lines(rest))
+    n = len(lines) // 4 * 4
+
+    if n:
+        yield lines[:n], check_fastq_lines(lines[:n])
+    if n < len(lines):
+        LOG.warning("The last fastq record is truncated")
+
+
+def yield_fastq_lengths(stream, size=BLOCK_SIZE):
+    """
+    yield the sequence lengths of fastq records from a binary stream,
+    one array per block, see yield_fastq_lines
+    :param stream: a binary stream object
+    :param size: the size of blocks read from stream
+    :return: arrays of lengths
+    """
+    for lines, lengths in yield_fastq_lines(stream, size):
+        yield lengths
+
+
+def scan_lengths(filename, start=0, end=None):
+    """
+    read fastq file and return the lengths of records
+    :param filename:
+    :param start: the start offset of records, see find_record_start
+    :param end: the end offset of records
+    :return: array('Q') of lengths
+    """
+    check_format(filename)
+    if filename != STDIN:
+        filename = os.path.abspath(filename)
+    r = array("Q")
+
+    LOG.info("Scan fastq lengths from %r" % filename)
+
+    with open_stream(filename, start, end) as stream:
+        for lengths in yield_fastq_lengths(stream):
+            r.extend(lengths)
+
+    return r
+
+
+def open_fastq(filename, start=0, end=None, skip=0, read_ahead=READ_AHEAD_DEPTH, size=READ_AHEAD_SIZE):
     """
     read fastq file and return fastq records
     :param filename:
+    :param start: the start offset of records, see find_record_start
+    :param end: the end offset of records
+    :param skip: the number of records to skip after start, located by the index if exists and start is 0
+    :param read_ahead: the number of blocks read ahead in a thread, see open_stream
+    :param size: the size of blocks read ahead
     :return:
     """
     check_format(filename)
 
-    filename = os.path.abspath(filename)
-    mode = 'r'
+    if filename != STDIN:
+        filename = os.path.abspath(filename)
 
     LOG.info("Parse fastq sequences from %r" % filename)
-    if filename.endswith(".gz"):
-        stream = gzip.open(filename, mode)
-    else:
-        stream = open(filename, mode)
 
-    return yield_fastq_records(stream)
+    # the index counts records from the start of file, so a skip after another start is read
+    if skip and not start and has_index(filename):
+        start, skip = FastqIndex(filename).offset(skip), 0
+
+    stream = io.TextIOWrapper(open_stream(filename, start, end, read_ahead, size))
+    records = yield_fastq_records(stream)
+
+    for i in range(skip):
+        next(records, None)
+
+    return records
+
+
+class FastqIndex(object):
+    """
+    Index of a fastq file (.fqi), the byte offset of every {step}th record
+    with the numbers of records and bases before it
+    """
+    DEFAULT_STEP = 1000
+
+    def __init__(self, filename, fqi=None):
+        self.filename = os.path.abspath(filename)
+        self.fqi = fqi or self.filename + ".fqi"
+        self.records = array("Q")
+        self.offsets = array("Q")
+        self.bases = array("Q")
+
+        with open(self.fqi) as fh:
+            for line in fh:
+                if line.startswith("#"):
+                    continue
+                record, offset, bases = line.split()
+                self.records.append(int(record))
+                self.offsets.append(int(offset))
+                self.bases.append(int(bases))
+
+    @classmethod
+    def build(cls, filename, fqi=None, step=DEFAULT_STEP):
+        """
+        build the index of an uncompressed or BGZF fastq file in one pass,
+        the last line holds the total number of records, bytes and bases;
+        offsets of BGZF file are virtual offsets
+        :param filename:
+        :param fqi: the index file, default is {filename}.fqi
+        :param step: index every {step}th record
+        :return: FastqIndex
+        """
+        check_format(filename)
+        filename = os.path.abspath(filename)
+        fqi = fqi or filename + ".fqi"
+
+        if not filename.endswith(".gz"):
+            stream = open(filename, "rb")
+            voffset = int
+        elif is_bgzf(filename):
+            stream = BgzfReader(filename)
+            voffset = stream.voffset
+        else:
+            raise Exception("%r is not in BGZF format, gzip fastq can not be indexed" % filename)
+
+        LOG.info("Build fastq index %r" % fqi)
+
+        try:
+            with stream, open(fqi + ".tmp", "w") as out:
+                out.write("#record\toffset\tbases\n")
+                for record, offset, bases in index_fastq_stream(stream, step):
+                    out.write("%s\t%s\t%s\n" % (record, voffset(offset), bases))
+        except Exception:
+            os.remove(fqi + ".tmp")
+            raise
+
+        os.rename(fqi + ".tmp", fqi)
+
+        return cls(filename, fqi)
+
+    @property
+    def number(self):
+        return self.records[-1]
+
+    @property
+    def total(self):
+        return self.bases[-1]
+
+    def offset(self, record):
+        """
+        return the byte offset of a record, records after the nearest indexed
+        one are skipped by reading lines
+        :param record: 0-based number of record
+        :return:
+        """
+        if record >= self.number:
+            return self.offsets[-1]
+
+        i = bisect.bisect_right(self.records, record) - 1
+        offset = self.offsets[i]
+        lines = 4 * (record - self.records[i])
+
+        if not lines:
+            return offset
+
+        if self.filename.endswith(".gz"):
+            stream = BgzfReader(self.filename, offset, threads=1)
+            voffset = stream.voffset
+        else:
+            stream = open(self.filename, "rb")
+            stream.seek(offset)
+            voffset = offset.__add__
+
+        with stream:
+            return voffset(skip_lines(stream, lines))
+
+    def partition(self, parts, mode="number", multiple=1):
+        """
+        cut the file into byte ranges with equal records or bases
+        :param parts: the max number of ranges
+        :param mode: number or length
+        :param multiple: ranges start at a multiple of {multiple} records
+        :return: a list of (start, end)
+        """
+        values = self.records if mode == "number" else self.bases
+        offsets = [0]
+
+        for i in range(1, parts):
+            k = bisect.bisect_left(values, values[-1] * i // parts)
+            record = int(round(1.0 * self.records[k] / multiple)) * multiple
+            offset = self.offset(record)
+
+            if offsets[-1] < offset < self.offsets[-1]:
+                offsets.append(offset)
+
+        offsets.append(self.offsets[-1])
+
+        return list(zip(offsets[:-1], offsets[1:]))
+
+
+def skip_lines(stream, number):
+    """
+    skip lines from a binary stream
+    :param stream: a binary stream object
+    :param number: the number of lines
+    :return: the number of bytes skipped
+    """
+    size = 0
+
+    for block in read_blocks(stream, SYNC_SIZE):
+        pos = -1
+
+        while number:
+            pos = block.find(b"\n", pos + 1)
+            if pos < 0:
+                break
+            number -= 1
+
+        if not number:
+            return size + pos + 1
+
+        size += len(block)
+
+    return size
+
+
+def index_fastq_stream(stream, step=FastqIndex.DEFAULT_STEP):
+    """
+    yield (record, offset, bases) of every {step}th record and the end
+    :param stream: a binary stream object
+    :param step:
+    :return:
+    """
+    rest = b""
+    record = offset = bases = 0
+
+    for block in read_blocks(stream):
+        lines = (rest + block).split(b"\n")
+        # keep the lines of the incomplete record for the next block
+        size = (len(lines) - 1) // 4 * 4
+        rest = b"\n".join(lines[size:])
+        lines = lines[:size]
+
+        if b"" in lines:
+            raise ValueError("Blank lines are not supported in fastq index")
+
+        crlf = lines and lines[0].endswith(b"\r")
+        last = 0
+        first = -record % step
+
+        for i in range(first, size // 4, step):
+            offset += sum(map(len, lines[last*4:i*4])) + (i - last) * 4
+            seqs = lines[last*4+1:i*4:4]
+            bases += sum(map(len, seqs)) - (len(seqs) if crlf else 0)
+            last = i
+            yield record + i, offset, bases
+
+        offset += sum(map(len, lines[last*4:])) + (size - last*4)
+        seqs = lines[last*4+1::4]
+        bases += sum(map(len, seqs)) - (len(seqs) if crlf else 0)
+        record += size // 4
+
+    if rest.strip():
+        # the last record without newline
+        lines = rest.split(b"\n")
+        if len(lines) != 4:
+            raise ValueError("The last fastq record is truncated")
+        if record % step == 0:
+            yield record, offset, bases
+        offset += len(rest)
+        bases += len(lines[1].rstrip(b"\r"))
+        record += 1
+
+    yield record, offset, bases
+
+
+def has_index(filename):
+    """
+    check whether the .fqi of a fastq file exists and is up to date
+    :param filename:
+    :return:
+    """
+    if is_pipe(filename):
+        return False
+
+    fqi = filename + ".fqi"
+    return os.path.exists(fqi) and os.path.getmtime(fqi) >= os.path.getmtime(filename)
 
@@ -0,0 +1,183 @@
+
+import logging
+from array import array
+from bisect import bisect_left
+from itertools import accumulate
+
+from seqkit.common import get_seq_format
+from seqkit.FastaReader import yield_fasta_raw
+from seqkit.FastqReader import yield_fastq_lines
+from seqkit.stream import BLOCK_SIZE, open_stream
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+LOG = logging.getLogger(__name__)
+BATCH_SIZE = 10000
+
+
+class RecordBatch(object):
+    """
+    a batch of records in columns: the sequences of records joined in one
+    buffer, the qualities joined in another(None for fasta), the offsets
+    of records in the buffers(n + 1 values), their lengths and ids
+    """
+    __slots__ = ("ids", "seq", "qual", "offsets", "lengths")
+
+    def __init__(self, ids, seq, qual, offsets, lengths):
+        self.ids = ids
+        self.seq = seq
+        self.qual = qual
+        self.offsets = offsets
+        self.lengths = lengths
+
+    def __len__(self):
+        return len(self.lengths)
+
+    @property
+    def bases(self):
+        return len(self.seq)
+
+    def get(self, i):
+        """
+        return the i-th record
+        :param i:
+        :return: (id, seq, quality or None) in bytes
+        """
+        start, end = self.offsets[i], self.offsets[i+1]
+        qual = self.qual[start:end] if self.qual is not None else None
+
+        return self.ids[i] if self.ids is not None else None, self.seq[start:end], qual
+
+    def seq_array(self):
+        """
+        return the sequences as a numpy uint8 array without copy
+        """
+        return np.frombuffer(self.seq, dtype=np.uint8)
+
+    def qual_array(self, offset=33):
+        """
+        return the quality values as a numpy uint8 array
+        :param offset: the offset of quality values
+        :return:
+        """
+        return np.frombuffer(self.qual, dtype=np.uint8) - np.uint8(offset)
+
+    def offsets_array(self):
+        return np.frombuffer(self.offsets, dtype=np.uint64)
+
+    def lengths_array(self):
+        return np.frombuffer(self.lengths, dtype=np.uint64)
+
+
+def yield_fasta_columns(stream, size=BLOCK_SIZE):
+    """
+    yield the columns of fasta records, in lists of about {size} bases
+    :param stream: a binary stream object
+    :param size: the bases of each list
+    :return: (headers, seqs, None, array of lengths)
+    """
+    headers = []
+    seqs = []
+    lengths = array("Q")
+    bases = 0
+
+    for raw, length in yield_fasta_raw(stream):
+        end = raw.find(b"\n")
+        headers.append(raw[:end])
+        seqs.append(raw[end+1:].translate(None, b"\r\n \t"))
+        lengths.append(length)
+        bases += length
+
+        if bases >= size:
+            yield headers, seqs, None, lengths
+            headers, seqs, lengths, bases = [], [], array("Q"), 0
+
+    if lengths:
+        yield headers, seqs, None, lengths
+
+
+def yield_fastq_columns(stream, size=BLOCK_SIZE):
+    """
+    yield the columns of fastq records, one list of each column per block,
+    the lines of a block are split and checked once, see yield_fastq_lines
+    :param stream: a binary stream object
+    :param size: the size of blocks read from stream
+    :return: (headers, seqs, quals, array of lengths)
+    """
+    for lines, lengths in yield_fastq_lines(stream, size):
+        yield lines[0::4], lines[1::4], lines[3::4], lengths
+
+
+def iter_stream_batches(stream, fmt, batch_size=BATCH_SIZE, max_bases=None, ids=True):
+    """
+    yield batches of records from a binary stream, the columns of
+    each block are cut into batches by slices
+    :param stream: a binary stream object
+    :param fmt: fasta or fastq
+    :param batch_size: the max number of records of each batch
+    :param max_bases: the max bases of each batch, a batch holds at least one record
+    :param ids: keep the ids of records
+    :return: RecordBatch
+    """
+    if fmt == "fasta":
+        columns = yield_fasta_columns(stream)
+    else:
+        columns = yield_fastq_columns(stream)
+
+    names = []
+    seqs = []
+    quals = []
+    offsets = array("Q", [0])
+    lengths = array("Q")
+
+    for block_headers, block_seqs, block_quals, block_lengths in columns:
+        start = 0
+
+        while start < len(block_lengths):
+            end = min(len(block_lengths), start + batch_size - len(lengths))
+            ends = array("Q", accumulate(block_lengths[start:end], initial=offsets[-1]))[1:]
+
+            # the batch ends at the first record reaching max_bases
+            if max_bases and ends[-1] >= max_bases:
+                end = start + bisect_left(ends, max_bases) + 1
+                ends = ends[:end - start]
+
+            if ids:
+                names.extend((header[1:].split(None, 1) or [b""])[0].decode() for header in block_headers[start:end])
+            seqs.extend(block_seqs[start:end])
+            if block_quals is not None:
+                quals.extend(block_quals[start:end])
+            lengths.extend(block_lengths[start:end])
+            offsets.extend(ends)
+            start = end
+
+            if len(lengths) >= batch_size or (max_bases and offsets[-1] >= max_bases):
+                yield RecordBatch(names if ids else None, b"".join(seqs),
+                                  b"".join(quals) if fmt == "fastq" else None, offsets, lengths)
+                names, seqs, quals, offsets, lengths = [], [], [], array("Q", [0]), array("Q")
+
+    if lengths:
+        yield RecordBatch(names if ids else None, b"".join(seqs),
+                          b"".join(quals) if fmt == "fastq" else None, offsets, lengths)
+
+
+def iter_batches(filename, batch_size=BATCH_SIZE, start=0, end=None, max_bases=None, ids=True):
+    """
+    read a fasta or fastq file in batches of columns, see RecordBatch
+    :param filename:
+    :param batch_size: the max number of records of each batch
+    :param start: the start offset of records, see open_stream
+    :param end: the end offset of records
+    :param max_bases: the max bases of each batch
+    :param ids: keep the ids of records
+    :return: RecordBatch
+    """
+    prefix, fmt = get_seq_format(filename)
+
+    with open_stream(filename, start, end) as stream:
+        for batch in iter_stream_batches(stream, fmt, batch_size, max_bases, ids):
+            yield batch
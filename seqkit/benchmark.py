@@ -0,0 +1,409 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import gzip
+import json
+import time
+import random
+import shutil
+import logging
+import argparse
+import platform
+import subprocess
+
+from seqkit.common import mkdir
+from seqkit.FastqReader import FastqIndex
+from seqkit.metrics import get_max_rss
+from seqkit.stream import MIN_RANGE_SIZE, TMP_SUFFIX, open_output
+from seqkit import __author__, __version__, __email__
+
+
+LOG = logging.getLogger(__name__)
+CASES = ["read", "batch", "stat", "split"]
+SHORT_READ_LENGTH = 150
+LONG_READ_LENGTH = (1000, 30000)
+CHROMOSOMES = 8
+LINE_WIDTH = 60
+CHUNK_SIZE = 1 << 20
+# large enough to be cut into ranges without --task_size
+DEFAULT_SIZE = 2 * MIN_RANGE_SIZE >> 20
+# stat and split cut the files into tasks of TASK_SIZE, so that each -c has tasks for all processes
+TASK_SIZE = 8 << 20
+# split -m number writes about SPLIT_FILES files of each dataset
+SPLIT_FILES = 64
+
+# each random byte to a base, about 1/256 of bases are N
+BASE_TABLE = bytes(bytearray(b"ACGT"[i % 4] for i in range(255)) + b"N")
+# each random byte to a phred quality from 2 to 41
+QUAL_TABLE = bytes(bytearray(33 + 2 + i % 40 for i in range(256)))
+
+
+def random_bytes(rng, size, table):
+    """
+    return size random bytes translated by table
+    :param rng: random.Random
+    :param size:
+    :param table: a translation table of 256 bytes
+    :return:
+    """
+    if not size:
+        return b""
+
+    return rng.getrandbits(8 * size).to_bytes(size, "little").translate(table)
+
+
+def write_short_reads(filename, size, rng):
+    """
+    write single-end short reads of fixed length in fastq
+    :return: (records, bases)
+    """
+    records = bases = 0
+
+    with open(filename, "wb") as fh:
+        while fh.tell() < size:
+            lines = []
+            for i in range(1000):
+                records += 1
+                lines.append(b"@short%d 1:N:0:1\n%s\n+\n%s\n" % (
+                    records,
+                    random_bytes(rng, SHORT_READ_LENGTH, BASE_TABLE),
+                    random_bytes(rng, SHORT_READ_LENGTH, QUAL_TABLE)))
+            fh.write(b"".join(lines))
+            bases += 1000 * SHORT_READ_LENGTH
+
+    return records, bases
+
+
+def write_long_reads(filename, size, rng):
+    """
+    write long reads of variable length in fastq
+    :return: (records, bases)
+    """
+    records = bases = 0
+
+    with open(filename, "wb") as fh:
+        while fh.tell() < size:
+            length = rng.randint(*LONG_READ_LENGTH)
+            records += 1
+            bases += length
+            fh.write(b"@long%d length=%d\n%s\n+\n%s\n" % (
+                records, length,
+                random_bytes(rng, length, BASE_TABLE),
+                random_bytes(rng, length, QUAL_TABLE)))
+
+    return records, bases
+
+
+def write_genome(filename, size, rng):
+    """
+    write a genome of CHROMOSOMES chromosomes in fasta, wrapped in LINE_WIDTH
+    :return: (records, bases)
+    """
+    total = size * LINE_WIDTH // (LINE_WIDTH + 1)
+    bases = 0
+
+    with open(filename, "wb") as fh:
+        for i in range(CHROMOSOMES):
+            # the chromosomes get shorter, like a real genome
+            length = max(total * (CHROMOSOMES - i) * 2 // (CHROMOSOMES * (CHROMOSOMES + 1)), 1)
+            bases += length
+            fh.write(b">chr%d\n" % (i + 1))
+
+            for start in range(0, length, CHUNK_SIZE // LINE_WIDTH * LINE_WIDTH):
+                seq = random_bytes(rng, min(CHUNK_SIZE // LINE_WIDTH * LINE_WIDTH, length - start), BASE_TABLE)
+                fh.write(b"".join(seq[j:j + LINE_WIDTH] + b"\n" for j in range(0, len(seq), LINE_WIDTH)))
+
+    return CHROMOSOMES, bases
+
+
+def gzip_file(filename, level=1):
+    """
+    compress filename to filename.gz, with a fixed mtime for the same bytes each time
+    :return: the name of compressed file
+    """
+    out = filename + ".gz"
+
+    with open(filename, "rb") as fh, open(out, "wb") as raw:
+        with gzip.GzipFile(filename="", mode="wb", compresslevel=level, fileobj=raw, mtime=0) as gz:
+            shutil.copyfileobj(fh, gz, CHUNK_SIZE)
+
+    return out
+
+
+def bgzf_file(filename, level=1):
+    """
+    compress filename to BGZF, {prefix}.bgzf.{ext}.gz, which is cut into ranges like a plain file
+    :return: the name of compressed file
+    """
+    out = get_dataset_names(filename)[2]
+
+    with open(filename, "rb") as fh, open_output(out, "bgzf", level) as raw:
+        shutil.copyfileobj(fh, raw, CHUNK_SIZE)
+
+    return out
+
+
+def get_dataset_names(name):
+    """
+    the names of the plain, gzip and BGZF datasets of a plain file, also for paths
+    """
+    prefix, ext = os.path.splitext(name)
+
+    return [name, name + ".gz", "%s.bgzf%s.gz" % (prefix, ext)]
+
+
+def make_datasets(data_dir, size, seed=1):
+    """
+    generate the synthetic datasets, the same size and seed give the same files;
+    the .fqi of plain and BGZF fastq are built, so that split -m number cuts them
+    :param data_dir:
+    :param size: the size of each plain dataset in bytes
+    :param seed:
+    :return: a list of datasets, dicts of name, path, format, records, bases and size
+    """
+    mkdir(data_dir)
+    meta = os.path.join(data_dir, "datasets.json")
+    specs = [
+        ("short.fq", "fastq", write_short_reads),
+        ("long.fq", "fastq", write_long_reads),
+        ("genome.fa", "fasta", write_genome)
+    ]
+    names = [i for name, fmt, func in specs for i in get_dataset_names(name)]
+
+    if os.path.exists(meta):
+        with open(meta) as fh:
+            datasets = json.load(fh)
+
+        # the datasets of an older version are generated again
+        if [i["name"] for i in datasets] == names and all(os.path.exists(i["path"]) for i in datasets):
+            LOG.info("Reuse the datasets in %r" % data_dir)
+            return datasets
+
+    datasets = []
+
+    for name, fmt, func in specs:
+        filename = os.path.join(data_dir, name)
+        LOG.info("Generate %r" % filename)
+        records, bases = func(filename, size, random.Random("%s:%s" % (seed, name)))
+        paths = [filename, gzip_file(filename), bgzf_file(filename)]
+
+        if fmt == "fastq":
+            for path in [paths[0], paths[2]]:
+                FastqIndex.build(path)
+
+        for path in paths:
+            datasets.append({
+                "name": os.path.basename(path),
+                "path": path,
+                "format": fmt,
+                "records": records,
+                "bases": bases,
+                "size": os.path.getsize(path)
+            })
+
+    with open(meta + TMP_SUFFIX, "w") as fh:
+        json.dump(datasets, fh, indent=2)
+    os.replace(meta + TMP_SUFFIX, meta)
+
+    return datasets
+
+
+def run_case(case, filename, concurrent, work_dir, records=SPLIT_FILES):
+    """
+    run one case of benchmark in this process, see measure; stat and split
+    cut plain and BGZF files into tasks of TASK_SIZE, split -m number cuts
+    only indexed fastq, gzip and fasta are split in one task
+    :param case: one of CASES
+    :param filename:
+    :param concurrent:
+    :param work_dir: an empty directory for outputs
+    :param records: the number of records of file, split into SPLIT_FILES files
+    :return:
+    """
+    from seqkit.common import get_seq_format
+
+    prefix, fmt = get_seq_format(filename)
+
+    if case == "read":
+        if fmt == "fasta":
+            from seqkit.FastaReader import open_fasta as open_records
+        else:
+            from seqkit.FastqReader import open_fastq as open_records
+        for record in open_records(filename):
+            len(record)
+    elif case == "batch":
+        from seqkit.batch import iter_batches
+        for batch in iter_batches(filename, ids=False):
+            pass
+    elif case == "stat":
+        from seqkit.stat import seq_stat
+        seq_stat([filename], concurrent=concurrent, task_size=TASK_SIZE)
+    elif case == "split":
+        from seqkit.split import seq_split
+        seq_split([filename], "number", max(records // SPLIT_FILES, 1), os.path.join(work_dir, "split"),
+                  concurrent=concurrent, task_size=TASK_SIZE)
+    else:
+        raise ValueError("Unknown benchmark case %r" % case)
+
+
+def measure(case, dataset, concurrent, work_dir):
+    """
+    run a case in a new process, for the peak RSS of each case
+    :param case: one of CASES
+    :param dataset: see make_datasets
+    :param concurrent:
+    :param work_dir:
+    :return: a dict of the result
+    """
+    case_dir = os.path.join(work_dir, "%s.%s.%s" % (case, dataset["name"], concurrent))
+    shutil.rmtree(case_dir, ignore_errors=True)
+    mkdir(case_dir)
+
+    package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join([package_dir] + [i for i in [env.get("PYTHONPATH")] if i])
+
+    code = "import sys; from seqkit.benchmark import run_case; " \
+           "run_case(sys.argv[1], sys.argv[2], int(sys.argv[3]), sys.argv[4], int(sys.argv[5]))"
+
+    with open(os.path.join(case_dir, "stderr.log"), "wb") as err, open(os.devnull, "wb") as out:
+        start = time.time()
+        proc = subprocess.Popen([sys.executable, "-c", code, case, os.path.abspath(dataset["path"]),
+                                 str(concurrent), case_dir, str(dataset["records"])], cwd=case_dir, env=env, stdout=out, stderr=err)
+        # wait4 gives the usage of this child and its pool workers only
+        pid, status, rusage = os.wait4(proc.pid, 0)
+        seconds = time.time() - start
+        proc.returncode = os.waitstatus_to_exitcode(status)
+
+    if proc.returncode != 0:
+        with open(os.path.join(case_dir, "stderr.log")) as fh:
+            LOG.error(fh.read())
+        raise Exception("Benchmark %s on %r failed" % (case, dataset["name"]))
+
+    shutil.rmtree(case_dir, ignore_errors=True)
+    seconds = max(seconds, 1e-6)
+
+    r = {
+        "case": case,
+        "dataset": dataset["name"],
+        "concurrent": concurrent,
+        "seconds": round(seconds, 4),
+        "user_seconds": round(rusage.ru_utime, 4),
+        "sys_seconds": round(rusage.ru_stime, 4),
+        "records_per_second": round(dataset["records"] / seconds, 2),
+        "mb_per_second": round(dataset["size"] / seconds / (1 << 20), 2),
+        "bases_per_second": round(dataset["bases"] / seconds, 2),
+        "max_rss_mb": round(get_max_rss(rusage), 2)
+    }
+    LOG.info("%s\t%s\t-c %s\t%.2fs\t%.2f MB/s\t%.1f MB RSS" % (
+        case, dataset["name"], concurrent, seconds, r["mb_per_second"], r["max_rss_mb"]))
+
+    return r
+
+
+def get_commit():
+    """
+    return the git commit of the package, None if it is not in a git repository
+    """
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], stderr=subprocess.STDOUT,
+            cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def seq_benchmark(output, work_dir="benchmark", size=DEFAULT_SIZE, seed=1, concurrents=(1, 2, 4), cases=CASES, repeat=1):
+    """
+    benchmark the readers and commands on synthetic datasets and write the results in json
+    :param output: the json file of results
+    :param work_dir: the directory of datasets and outputs, the datasets are reused by later runs
+    :param size: the size of each plain dataset in MB
+    :param seed: the seed of datasets
+    :param concurrents: the numbers of processes for stat and split
+    :param cases: see CASES
+    :param repeat: run each case repeat times
+    :return: the results
+    """
+    work_dir = mkdir(work_dir)
+    datasets = make_datasets(os.path.join(work_dir, "data.%sM.%s" % (size, seed)), size << 20, seed)
+    results = []
+
+    for case in cases:
+        # the readers run in one process
+        for concurrent in ([1] if case in ["read", "batch"] else concurrents):
+            for dataset in datasets:
+                for i in range(repeat):
+                    results.append(measure(case, dataset, concurrent, work_dir))
+
+    r = {
+        "version": __version__,
+        "commit": get_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "size": size,
+        "seed": seed,
+        "task_size": TASK_SIZE,
+        "datasets": [dict((k, v) for k, v in i.items() if k != "path") for i in datasets],
+        "results": results
+    }
+
+    with open(output, "w") as fh:
+        json.dump(r, fh, indent=2)
+
+    LOG.info("Write the results to %r" % output)
+
+    return r
+
+
+def benchmark_args(parser):
+
+    parser.add_argument("-o", "--output", metavar="FILE", default="benchmark.json",
+                        help="the json file of results, default benchmark.json")
+    parser.add_argument("-d", "--work_dir", metavar="DIR", default="benchmark",
+                        help="the directory of datasets and temporary outputs, default benchmark")
+    parser.add_argument("-s", "--size", metavar="INT", type=int, default=DEFAULT_SIZE,
+                        help="the size of each dataset in MB, default %s" % DEFAULT_SIZE)
+    parser.add_argument("--seed", metavar="INT", type=int, default=1,
+                        help="the seed of datasets, default 1")
+    parser.add_argument("-c", "--concurrent", metavar="INT", type=int, nargs="+", default=[1, 2, 4],
+                        help="the numbers of processes for stat and split, default 1 2 4")
+    parser.add_argument("--cases", metavar="STR", nargs="+", choices=CASES, default=CASES,
+                        help="the cases to run, in %s, default all" % ", ".join(CASES))
+    parser.add_argument("-r", "--repeat", metavar="INT", type=int, default=1,
+                        help="run each case INT times, default 1")
+
+    return parser
+
+
+def benchmark(args):
+
+    seq_benchmark(args.output, args.work_dir, args.size, args.seed, args.concurrent, args.cases, args.repeat)
+
+
+def main():
+
+    logging.basicConfig(
+        stream=sys.stderr,
+        level=logging.INFO,
+        format="[%(levelname)s] %(message)s"
+    )
+
+    parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter,
+                                     description="""
+Benchmark the readers and commands on synthetic datasets
+
+version: %s
+contact: %s <%s>\
+""" % (__version__, " ".join(__author__), __email__))
+
+    args = benchmark_args(parser).parse_args()
+    benchmark(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+
+import io
+import zlib
+import bisect
+import struct
+import time
+import logging
+from array import array
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from seqkit.metrics import record_stage
+
+LOG = logging.getLogger(__name__)
+THREADS = 4
+BATCH_SIZE = 1 << 20
+MAX_BLOCK_DATA = 65280
+BGZF_MAGIC = b"\x1f\x8b\x08\x04"
+BGZF_HEADER = b"\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00\x42\x43\x02\x00"
+BGZF_EOF = BGZF_HEADER + b"\x1b\x00\x03\x00\x00\x00\x00\x00\x00\x00\x00\x00"
+
+
+def is_bgzf(filename):
+    """
+    check whether a file is in BGZF format
+    :param filename:
+    :return:
+    """
+    with open(filename, "rb") as fh:
+        header = fh.read(12)
+
+        if len(header) < 12 or not header.startswith(BGZF_MAGIC):
+            return False
+
+        extra = fh.read(struct.unpack("<H", header[10:12])[0])
+
+    return get_block_size(extra) is not None
+
+
+def get_block_size(extra):
+    """
+    get the block size(BSIZE + 1) from the extra field of gzip header
+    :param extra:
+    :return: None if the BC subfield not exists
+    """
+    pos = 0
+
+    while pos + 4 <= len(extra):
+        slen = struct.unpack("<H", extra[pos+2:pos+4])[0]
+        if extra[pos:pos+2] == b"BC" and slen == 2:
+            return struct.unpack("<H", extra[pos+4:pos+6])[0] + 1
+        pos += 4 + slen
+
+    return None
+
+
+def read_block(fh):
+    """
+    read a raw BGZF block
+    :param fh: a binary file object
+    :return: (block size, deflated data) or None at the end of file
+    """
+    header = fh.read(12)
+
+    if not header:
+        return None
+    if len(header) < 12 or not header.startswith(BGZF_MAGIC):
+        raise ValueError("Invalid BGZF block at %s" % (fh.tell() - len(header)))
+
+    xlen = struct.unpack("<H", header[10:12])[0]
+    extra = fh.read(xlen)
+    size = get_block_size(extra)
+
+    if size is None:
+        raise ValueError("Invalid BGZF block at %s" % (fh.tell() - 12 - xlen))
+
+    data = fh.read(size - 12 - xlen)
+
+    return size, data[:-8]
+
+
+def inflate_blocks(blocks):
+    """
+    inflate raw blocks, zlib releases the GIL so it runs in threads
+    :param blocks: a list of (offset, deflated data)
+    :return: a list of (offset, data)
+    """
+    return [(offset, zlib.decompress(data, -15)) for offset, data in blocks]
+
+
+def find_block(fh, offset, size):
+    """
+    find the offset of the first block at or after offset, a candidate
+    header is accepted if another header or the end of file follows it
+    :param fh: a binary file object
+    :param offset:
+    :param size: the size of file
+    :return:
+    """
+    while offset < size:
+        fh.seek(offset)
+        buf = fh.read(1 << 17)
+        pos = buf.find(BGZF_MAGIC)
+
+        while pos >= 0:
+            fh.seek(offset + pos)
+            try:
+                read_block(fh)
+                if fh.tell() >= size or read_block(fh) is not None:
+                    return offset + pos
+            except (ValueError, struct.error):
+                pass
+            pos = buf.find(BGZF_MAGIC, pos + 1)
+
+        offset += max(len(buf) - len(BGZF_MAGIC), 1)
+
+    return size
+
+
+class BgzfReader(io.RawIOBase):
+    """
+    read a BGZF file between virtual offsets, blocks are inflated in a
+    thread pool ahead of the reader
+    """
+    def __init__(self, filename, start=0, end=None, threads=THREADS):
+        self._fh = open(filename, "rb")
+        self._end = end
+        self._skip = start & 0xFFFF
+        self._threads = threads
+        self._blocks = self._inflate(start >> 16)
+        self._data = memoryview(b"")
+        self._pos = 0
+        self._read = 0
+        # the local position at the start of each block, to map positions to virtual offsets
+        self._offsets = array("Q")
+        self._bases = array("q")
+        # the time the reader waited for inflation
+        self.stall_time = 0.0
+
+    def _read_batches(self, offset):
+        end = None if self._end is None else self._end >> 16
+        self._fh.seek(offset)
+        batch = []
+        batch_size = 0
+
+        while end is None or offset <= end:
+            block = read_block(self._fh)
+
+            if block is None:
+                break
+
+            batch.append((offset, block[1]))
+            batch_size += block[0]
+            offset += block[0]
+
+            if batch_size >= BATCH_SIZE:
+                yield batch
+                batch = []
+                batch_size = 0
+
+        if batch:
+            yield batch
+
+    def _inflate(self, offset):
+        if self._threads <= 1:
+            for batch in self._read_batches(offset):
+                for block in inflate_blocks(batch):
+                    yield block
+            return
+
+        pool = ThreadPoolExecutor(self._threads)
+        pending = deque()
+
+        try:
+            for batch in self._read_batches(offset):
+                pending.append(pool.submit(inflate_blocks, batch))
+
+                while len(pending) > 2 * self._threads:
+                    for block in self._wait(pending.popleft()):
+                        yield block
+
+            while pending:
+                for block in self._wait(pending.popleft()):
+                    yield block
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def _wait(self, future):
+        start = time.time()
+        r = future.result()
+        self.stall_time += time.time() - start
+        return r
+
+    def _next_block(self):
+        for offset, data in self._blocks:
+            skip, self._skip = self._skip, 0
+
+            if self._end is not None and offset == self._end >> 16:
+                data = data[:self._end & 0xFFFF]
+
+            self._offsets.append(offset)
+            self._bases.append(self._read - skip)
+
+            if len(data) > skip:
+                self._data = memoryview(data)
+                self._pos = skip
+                return True
+
+        return False
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        size = 0
+
+        while size < len(b):
+            if self._pos >= len(self._data) and not self._next_block():
+                break
+
+            n = min(len(b) - size, len(self._data) - self._pos)
+            b[size:size+n] = self._data[self._pos:self._pos+n]
+            self._pos += n
+            self._read += n
+            size += n
+
+        return size
+
+    def tell(self):
+        """
+        the number of bytes read from the start of reader
+        """
+        return self._read
+
+    def voffset(self, pos):
+        """
+        map a position in the data read to its virtual offset
+        :param pos: the number of bytes from the start of reader
+        :return:
+        """
+        if not self._offsets:
+            return 0
+
+        i = max(bisect.bisect_right(self._bases, pos) - 1, 0)
+
+        return self._offsets[i] << 16 | (pos - self._bases[i])
+
+    def close(self):
+        if self.closed:
+            return
+
+        self._blocks.close()
+        self._fh.close()
+        record_stage("read", calls=1, bytes_out=self._read, stall_time=self.stall_time)
+        super(BgzfReader, self).close()
+
+
+def deflate_block(data, level=6):
+    """
+    compress data of at most MAX_BLOCK_DATA bytes to a BGZF block
+    :param data:
+    :param level: compression level
+    :return:
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    cdata = compressor.compress(data) + compressor.flush()
+
+    return b"".join([
+        BGZF_HEADER[:16],
+        struct.pack("<H", len(cdata) + 25),
+        cdata,
+        struct.pack("<II", zlib.crc32(data) & 0xFFFFFFFF, len(data))
+    ])
+
+
+def deflate_blocks(data, level=6):
+    """
+    compress data to BGZF blocks
+    :param data:
+    :param level: compression level
+    :return:
+    """
+    view = memoryview(data)
+
+    return b"".join([deflate_block(view[i:i+MAX_BLOCK_DATA], level)
+                     for i in range(0, len(data), MAX_BLOCK_DATA)])
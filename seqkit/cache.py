@@ -0,0 +1,119 @@
+
+import os
+import hashlib
+import logging
+
+from seqkit.stream import TMP_SUFFIX
+
+LOG = logging.getLogger(__name__)
+CACHE_SUFFIX = ".cache"
+DEFAULT_CACHE_SIZE = 256 << 20
+
+
+class StatCache(object):
+    """
+    an on-disk cache of per-file summaries in a directory, keyed by the
+    absolute path, size, mtime and format of file, the least recently
+    used entries are removed when the cache is over max_size
+    """
+    def __init__(self, directory, max_size=DEFAULT_CACHE_SIZE):
+        self.directory = os.path.abspath(directory)
+        self.max_size = max_size
+        self._total = None  # the size of entries, scanned by the first put
+
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+    @staticmethod
+    def get_key(filename, fmt):
+        """
+        the key of a file, taken before the file is read so that a file
+        changed during the read is not cached as the new one
+        :param filename:
+        :param fmt:
+        :return:
+        """
+        st = os.stat(filename)
+        return "%s\t%s\t%s\t%s" % (os.path.abspath(filename), st.st_size, st.st_mtime_ns, fmt)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest() + CACHE_SUFFIX)
+
+    def get(self, key):
+        """
+        get the cached data of a file
+        :param key: see get_key
+        :return: bytes or None if not cached or the file is changed
+        """
+        path = self._path(key)
+
+        try:
+            with open(path, "rb") as fh:
+                head = fh.readline()
+                data = fh.read()
+        except (IOError, OSError):
+            return None
+
+        if head.rstrip(b"\n").decode("utf-8", "replace") != key:
+            return None
+
+        os.utime(path, None)  # the mtime of entry is its last use
+
+        return data
+
+    def put(self, key, data):
+        """
+        cache the data of a file, the cache is scanned only when it may be over max_size
+        :param key: see get_key, taken before the file is read
+        :param data: bytes
+        :return:
+        """
+        path = self._path(key)
+
+        if self._total is None:
+            self.evict()
+
+        with open(path + TMP_SUFFIX, "wb") as fh:
+            fh.write(key.encode() + b"\n")
+            fh.write(data)
+            size = fh.tell()
+
+        os.replace(path + TMP_SUFFIX, path)
+        self._total += size
+
+        if self._total > self.max_size:
+            self.evict()
+
+    def evict(self):
+        """
+        remove the least recently used entries until the cache is not over max_size
+        :return:
+        """
+        entries = []
+
+        for name in os.listdir(self.directory):
+            if not name.endswith(CACHE_SUFFIX):
+                continue
+
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:  # removed by another run
+                continue
+
+            entries.append((st.st_mtime, st.st_size, path))
+
+        total = sum(size for mtime, size, path in entries)
+
+        for mtime, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+
+            LOG.debug("Remove the cache entry %r" % path)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+        self._total = total
@@ -1,9 +1,13 @@
 
 import logging
 import os
+import time
+import itertools
 
-from seqkit.FastaReader import ALLOWED_FASTA
-from seqkit.FastqReader import ALLOWED_FASTQ
+from seqkit import metrics
+from seqkit.FastaReader import ALLOWED_FASTA, find_record_start as find_fasta_start
+from seqkit.FastqReader import ALLOWED_FASTQ, find_record_start as find_fastq_start
+from seqkit.stream import MIN_RANGE_SIZE, STDIN, is_pipe, sniff_pipe, split_ranges
 
 
 LOG = logging.getLogger(__name__)
@@ -15,6 +19,8 @@ def get_seq_format(filename):
     :param filename:
     :return:
     """
+    if is_pipe(filename):
+        return get_pipe_format(filename)
 
     filename = filename.split("/")[-1]
 
@@ -36,6 +42,123 @@ def get_seq_format(filename):
     return prefix, fmt
 
 
+def get_pipe_format(filename):
+    """
+    the format of stdin or a named pipe is detected from its content,
+    the prefix is "stdin" or the name of pipe without the suffix
+    :param filename:
+    :return:
+    """
+    compression, fmt = sniff_pipe(filename)
+    prefix = "stdin" if filename == STDIN else filename.split("/")[-1]
+
+    for suffix in sorted(ALLOWED_FASTA + ALLOWED_FASTQ, key=len, reverse=True):
+        if prefix.lower().endswith(suffix):
+            prefix = prefix[:-len(suffix)]
+            break
+
+    return prefix, fmt
+
+
+def get_ranges(filename, fmt, parts, min_size=MIN_RANGE_SIZE):
+    """
+    cut a file into byte ranges aligned to record boundaries,
+    compressed file is not cut
+    :param filename:
+    :param fmt: fasta or fastq
+    :param parts: the max number of ranges
+    :param min_size: the min size of a range
+    :return: a list of (start, end)
+    """
+    if parts <= 1:
+        return [(0, None)]
+
+    if fmt == "fasta":
+        return split_ranges(filename, parts, find_fasta_start, min_size)
+    else:
+        return split_ranges(filename, parts, find_fastq_start, min_size)
+
+
+def get_task_parts(filename, concurrent, task_size=0):
+    """
+    get the number of ranges to cut a file into for tasks
+    :param filename:
+    :param concurrent: the number of processes
+    :param task_size: the size of each task, 0 to cut into {concurrent} ranges
+    :return: (the number of ranges, the min size of a range)
+    """
+    if not task_size:
+        return concurrent, MIN_RANGE_SIZE
+
+    parts = -(-os.path.getsize(filename) // task_size)
+
+    return max(parts, concurrent), min(task_size, MIN_RANGE_SIZE)
+
+
+def get_task_ranges(filename, fmt, concurrent, task_size=0):
+    """
+    cut a file into byte ranges for tasks, see get_ranges and get_task_parts
+    :param filename:
+    :param fmt: fasta or fastq
+    :param concurrent: the number of processes
+    :param task_size: the size of each task, 0 to cut into {concurrent} ranges
+    :return: a list of (start, end)
+    """
+    if is_pipe(filename):
+        return [(0, None)]
+
+    parts, min_size = get_task_parts(filename, concurrent, task_size)
+
+    return get_ranges(filename, fmt, parts, min_size)
+
+
+def run_task(task):
+    """
+    run a task in a worker of pool
+    :param task: (the index of task, function, args, metrics options or None)
+    :return: (the index of task, result, metrics of task or None)
+    """
+    i, func, args, options = task
+
+    if options is None:
+        return i, func(*args), None
+
+    r, data = metrics.run_task(func, args, options)
+
+    return i, r, data
+
+
+def imap_tasks(pool, tasks, labels=None, local=()):
+    """
+    run tasks in a pool from the largest one and yield results as they are finished
+    :param pool: multiprocessing.Pool
+    :param tasks: a list of (size, function, args)
+    :param labels: the file of each task, for metrics
+    :param local: the indexes of tasks run in this process, e.g. the tasks reading a pipe
+    :return: (the index of task, result)
+    """
+    order = sorted((i for i in range(len(tasks)) if i not in local), key=lambda i: tasks[i][0], reverse=True)
+    options = metrics.task_options()
+    local_options = None if options is None else dict(options, profile=None)
+    start = time.time()
+    busy = 0
+
+    # the pool runs its tasks while this process runs the local ones
+    results = pool.imap_unordered(run_task, [(i, tasks[i][1], tasks[i][2], options) for i in order])
+    local_results = (run_task((i, tasks[i][1], tasks[i][2], local_options)) for i in local)
+
+    for n, (i, r, data) in enumerate(itertools.chain(local_results, results), 1):
+        LOG.info("%s/%s tasks finished" % (n, len(tasks)))
+        if data is not None:
+            wall = metrics.merge_task(data, labels[i] if labels else None)
+            if i not in local:
+                busy += wall
+        yield i, r
+
+    if options is not None and order:
+        metrics.record_pool(pool, sorted(set(tasks[i][1].__name__ for i in order)), time.time() - start, busy)
+
+
 def check_paths(*paths):
     """
     check the existence of paths
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import sys
+import argparse
+import logging
+
+from seqkit.FastaReader import FastaIndex, has_index
+from seqkit.metrics import collect, metrics_args
+from seqkit import __author__, __version__, __email__
+
+
+LOG = logging.getLogger(__name__)
+
+
+def parse_region(region):
+    """
+    parse a samtools style region, name[:start[-end]], 1-based and inclusive
+    :param region:
+    :return: (name, 0-based start, end)
+    """
+    if ":" not in region:
+        return region, 0, None
+
+    name, pos = region.rsplit(":", 1)
+    pos = pos.replace(",", "")
+
+    try:
+        if "-" in pos:
+            start, end = pos.split("-", 1)
+            return name, int(start) - 1, int(end) if end else None
+        return name, int(pos) - 1, None
+    except ValueError:
+        return region, 0, None
+
+
+def seq_faidx(filename, regions=(), width=60, out=sys.stdout):
+    """
+    index a fasta file and print the sequences of regions
+    :param filename:
+    :param regions: samtools style regions
+    :param width: the line width of output sequences
+    :param out: the output stream
+    :return: FastaIndex
+    """
+    if has_index(filename):
+        index = FastaIndex(filename)
+    else:
+        index = FastaIndex.build(filename)
+
+    for region in regions:
+        name, start, end = region, 0, None
+
+        if region not in index:
+            name, start, end = parse_region(region)
+
+        seq = index.get(name, start, end)
+        out.write(">%s\n" % region)
+
+        for i in range(0, len(seq), width):
+            out.write(seq[i:i+width] + "\n")
+
+    index.close()
+
+    return index
+
+
+def faidx_args(parser):
+
+    parser.add_argument("fasta", metavar="FILE", help="uncompressed fasta file")
+    parser.add_argument("regions", metavar="REGIONs", nargs="*",
+                        help="regions to print, name[:start[-end]], 1-based and inclusive")
+    parser.add_argument("-w", "--width", metavar="INT", type=int, default=60,
+                        help="the line width of output sequences")
+    metrics_args(parser)
+
+    return parser
+
+
+def faidx(args):
+
+    with collect(args.metrics, args.profile, "faidx"):
+        seq_faidx(args.fasta, args.regions, args.width)
+
+
+def main():
+
+    logging.basicConfig(
+        stream=sys.stderr,
+        level=logging.INFO,
+        format="[%(levelname)s] %(message)s"
+    )
+
+    parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter,
+                                     description="""
+Index fasta files(.fai) and extract sequences
+
+version: %s
+contact: %s <%s>\
+""" % (__version__, " ".join(__author__), __email__))
+
+    args = faidx_args(parser).parse_args()
+    faidx(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,329 @@
+
+import os
+import sys
+import json
+import time
+import cProfile
+import logging
+import resource
+import threading
+from contextlib import contextmanager
+
+LOG = logging.getLogger(__name__)
+MB = 1 << 20
+
+_METRICS = None  # the Metrics of this process, None if disabled
+_PROFILE_DIR = None
+_PROFILER = None  # the profiler of the main process
+_WORKER_PROFILER = None  # the profiler of a pool worker, kept over its tasks
+
+
+class Metrics(object):
+    """
+    counters of the stages of a run: each stage adds up calls, wall and cpu
+    time, bytes_in, bytes_out, records and its own counters(e.g. stalls);
+    the stages of pool tasks are sent back with their results and merged
+    in the main process, also by file and by worker
+    """
+    def __init__(self, task=None):
+        self.task = task
+        self.stages = {}
+        self.files = {}
+        self.workers = {}
+        self.pools = []
+        self._lock = threading.Lock()
+
+    def add(self, stage, **values):
+        with self._lock:
+            add_counters(self.stages.setdefault(stage, {}), values)
+
+    def merge_task(self, data, label=None):
+        """
+        merge the metrics of a finished task, see run_task
+        :param data: the dict of run_task
+        :param label: the file of task
+        :return:
+        """
+        now = time.time()
+        wall = data["end"] - data["start"]
+
+        for stages in [self.stages, self.files.setdefault(label, {})] if label is not None else [self.stages]:
+            for stage, values in data["stages"].items():
+                add_counters(stages.setdefault(stage, {}), values)
+
+        # the time from the end of task to its result in the main process
+        self.add("ipc", calls=1, wall=max(now - data["end"], 0))
+        add_counters(self.workers.setdefault(str(data["pid"]), {}), {
+            "tasks": 1, "busy": wall, "cpu": data["cpu"]})
+
+        return wall
+
+    def report(self, command, wall, cpu, children_cpu):
+        """
+        the report of metrics, records/s and MB/s are derived from the wall time of each stage
+        """
+        files = {}
+
+        for name, stages in self.files.items():
+            tasks = [values for values in stages.values() if values.get("tasks")]
+            summary = {
+                "tasks": sum(i["tasks"] for i in tasks),
+                "wall": sum(i.get("wall", 0) for i in tasks),
+                "cpu": sum(i.get("cpu", 0) for i in tasks),
+                "records": sum(i.get("records", 0) for i in stages.values()),
+                "bytes_read": stages.get("read", {}).get("bytes_out", 0),
+                "bytes_written": stages.get("write", {}).get("bytes_out", 0)
+            }
+            files[name] = {"summary": derive(summary, "bytes_read"), "stages": derive_stages(stages)}
+
+        return {
+            "command": command,
+            "argv": sys.argv,
+            "pid": os.getpid(),
+            "wall": wall,
+            "cpu": cpu,
+            "children_cpu": children_cpu,
+            "max_rss_mb": get_max_rss(resource.getrusage(resource.RUSAGE_SELF)),
+            "children_max_rss_mb": get_max_rss(resource.getrusage(resource.RUSAGE_CHILDREN)),
+            "stages": derive_stages(self.stages),
+            "files": files,
+            "workers": self.workers,
+            "pools": self.pools
+        }
+
+
+def add_counters(counters, values):
+    for k, v in values.items():
+        counters[k] = counters.get(k, 0) + v
+
+    return counters
+
+
+def derive(values, size="bytes_in"):
+    """
+    add records_per_second and mb_per_second to the counters of a stage
+    """
+    r = dict(values)
+    wall = r.get("wall", 0)
+
+    if wall > 0:
+        if r.get("records"):
+            r["records_per_second"] = r["records"] / wall
+        if r.get(size) or r.get("bytes_out"):
+            r["mb_per_second"] = (r.get(size) or r.get("bytes_out")) / MB / wall
+
+    return r
+
+
+def derive_stages(stages):
+    return dict((stage, derive(values)) for stage, values in stages.items())
+
+
+def get_max_rss(rusage):
+    """
+    return the max resident set size of rusage in MB
+    """
+    if sys.platform == "darwin":  # in bytes on mac, in kilobytes on linux
+        return rusage.ru_maxrss / 1024.0 / 1024
+    return rusage.ru_maxrss / 1024.0
+
+
+def record_stage(stage, **values):
+    """
+    add values to a stage of metrics, nothing is done if metrics are disabled
+    :param stage: the name of stage
+    :param values: calls, wall, cpu, bytes_in, bytes_out, records or other counters
+    :return:
+    """
+    if _METRICS is not None:
+        _METRICS.add(stage, **values)
+
+
+def record_task(**values):
+    """
+    add values to the stage of the running task, see record_stage
+    """
+    if _METRICS is not None:
+        _METRICS.add(_METRICS.task or "main", **values)
+
+
+def count_records(records):
+    """
+    count the records of an iterable into the running task, records are
+    returned as they are if metrics are disabled
+    """
+    if _METRICS is None:
+        return records
+
+    return _count_records(records)
+
+
+def _count_records(records):
+    n = 0
+
+    try:
+        for record in records:
+            n += 1
+            yield record
+    finally:
+        record_task(records=n)
+
+
+def task_options():
+    """
+    the metrics options sent to pool tasks, None if metrics are disabled
+    """
+    if _METRICS is None:
+        return None
+
+    return {"profile": _PROFILE_DIR}
+
+
+def run_task(func, args, options):
+    """
+    run a task in a pool worker with fresh metrics, and profile it if asked
+    :param func:
+    :param args:
+    :param options: see task_options
+    :return: (result, a dict of the pid, start, end, cpu and stages of task)
+    """
+    global _METRICS, _WORKER_PROFILER
+
+    previous, _METRICS = _METRICS, Metrics(func.__name__)
+    profile = options.get("profile")
+
+    if profile and _WORKER_PROFILER is None:
+        _WORKER_PROFILER = cProfile.Profile()
+
+    start = time.time()
+    cpu = time.process_time()
+
+    try:
+        if profile:
+            _WORKER_PROFILER.enable()
+        try:
+            r = func(*args)
+        finally:
+            if profile:
+                _WORKER_PROFILER.disable()
+                # the profile of all tasks of this worker
+                _WORKER_PROFILER.dump_stats(os.path.join(profile, "worker.%s.prof" % os.getpid()))
+
+        end = time.time()
+        cpu = time.process_time() - cpu
+        _METRICS.add(func.__name__, tasks=1, wall=end - start, cpu=cpu)
+        stages = _METRICS.stages
+    finally:
+        _METRICS = previous
+
+    return r, {"pid": os.getpid(), "start": start, "end": end, "cpu": cpu, "stages": stages}
+
+
+def merge_task(data, label=None):
+    """
+    merge the metrics of a task into the metrics of this process, see run_task
+    :return: the wall time of task
+    """
+    if _METRICS is None:
+        return 0
+
+    return _METRICS.merge_task(data, label)
+
+
+def record_pool(pool, name, wall, busy):
+    """
+    record the utilisation of pool workers for a batch of tasks
+    :param pool: multiprocessing.Pool
+    :param name: the names of tasks
+    :param wall: the wall time from the first task submitted to the last result
+    :param busy: the sum of wall time of tasks
+    :return:
+    """
+    if _METRICS is None:
+        return
+
+    processes = getattr(pool, "_processes", 1) or 1
+
+    _METRICS.pools.append({
+        "tasks": name,
+        "processes": processes,
+        "wall": wall,
+        "busy": busy,
+        "utilisation": busy / wall / processes if wall > 0 else 0
+    })
+
+
+def _stop_inherited_profiler():
+    # a forked worker inherits the profiler of main process, it profiles itself, see run_task
+    if _PROFILER is not None:
+        _PROFILER.disable()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_stop_inherited_profiler)
+
+
+@contextmanager
+def collect(filename=None, profile=None, command=None):
+    """
+    collect the metrics of a run and write them to a json file,
+    nothing is collected if both filename and profile are None
+    :param filename: the json file of metrics
+    :param profile: the directory of cProfile outputs, main.{pid}.prof and worker.{pid}.prof
+    :param command: the name of command
+    :return: Metrics or None
+    """
+    global _METRICS, _PROFILE_DIR, _PROFILER
+
+    if not filename and not profile:
+        yield None
+        return
+
+    if profile:
+        profile = os.path.abspath(profile)
+        if not os.path.isdir(profile):
+            os.makedirs(profile)
+        _PROFILER = cProfile.Profile()
+
+    _METRICS = Metrics()
+    _PROFILE_DIR = profile
+    start = time.time()
+    cpu = time.process_time()
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    try:
+        if _PROFILER is not None:
+            _PROFILER.enable()
+        try:
+            yield _METRICS
+        finally:
+            if _PROFILER is not None:
+                _PROFILER.disable()
+                _PROFILER.dump_stats(os.path.join(profile, "main.%s.prof" % os.getpid()))
+                LOG.info("Write the profiles to %r" % profile)
+
+        metrics = _METRICS
+    finally:
+        _METRICS = _PROFILE_DIR = _PROFILER = None
+
+    if not filename:
+        return
+
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    r = metrics.report(command, time.time() - start, time.process_time() - cpu,
+                       usage.ru_utime + usage.ru_stime - children.ru_utime - children.ru_stime)
+
+    with open(filename, "w") as fh:
+        json.dump(r, fh, indent=2, sort_keys=True)
+
+    LOG.info("Write the metrics to %r" % filename)
+
+
+def metrics_args(parser):
+
+    parser.add_argument("--metrics", metavar="FILE", default=None,
+                        help="write the time, cpu, bytes and records of each stage, file and worker to a json FILE")
+    parser.add_argument("--profile", metavar="DIR", default=None,
+                        help="write the cProfile output of the main process and each worker to DIR")
+
+    return parser
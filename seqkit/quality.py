@@ -0,0 +1,236 @@
+
+import sys
+import struct
+import logging
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+LOG = logging.getLogger(__name__)
+QUALITY_MAGIC = b"SKQUAL\x01"
+QUALITY_OFFSET = 33
+
+
+def zeros(size):
+    """
+    return uint64 zeros, a numpy array or an array("Q") without numpy
+    :param size:
+    :return:
+    """
+    if np is not None:
+        return np.zeros(size, dtype=np.uint64)
+
+    return array("Q", bytes(8 * size))
+
+
+def add_values(values, other):
+    """
+    add other to values elementwise, values are extended to the size of other
+    :param values: see zeros
+    :param other: an iterable of int
+    :return: values
+    """
+    if np is not None:
+        other = np.asarray(other, dtype=np.uint64)
+        if len(other) > len(values):
+            values = np.concatenate([values, zeros(len(other) - len(values))])
+        values[:len(other)] += other
+        return values
+
+    other = list(other)
+    if len(other) > len(values):
+        values.extend([0] * (len(other) - len(values)))
+    for i, j in enumerate(other):
+        if j:
+            values[i] += j
+
+    return values
+
+
+def pack_values(values):
+    """
+    return the bytes of values as little-endian uint64
+    """
+    if np is not None:
+        return np.asarray(values, dtype="<u8").tobytes()
+
+    values = array("Q", values)
+    if sys.byteorder != "little":
+        values.byteswap()
+
+    return values.tobytes()
+
+
+def unpack_values(data):
+    """
+    load values from the bytes of pack_values
+    """
+    if np is not None:
+        return np.frombuffer(data, dtype="<u8").astype(np.uint64)
+
+    values = array("Q", data)
+    if sys.byteorder != "little":
+        values.byteswap()
+
+    return values
+
+
+def count_bytes(data):
+    """
+    count each byte value in data
+    :param data: bytes
+    :return: 256 counts
+    """
+    if np is not None:
+        return np.bincount(np.frombuffer(data, dtype=np.uint8), minlength=256)
+
+    r = [0] * 256
+
+    # one bytes.count for each distinct value, no loop over bases in python
+    for i in set(data):
+        r[i] = data.count(bytes((i, )))
+
+    return r
+
+
+class QualityAccumulator(object):
+    """
+    Summary of base composition and base quality: the count of each base
+    letter, the count of each quality value and the sum of quality of
+    each cycle, filled by batches of contiguous buffers and merged
+    cheaply between processes
+    """
+    def __init__(self):
+        self.bases = zeros(256)
+        self.quals = zeros(256)
+        self.cycle_sums = zeros(0)
+        self.cycle_counts = zeros(0)
+        self.cycles = np is not None
+
+    def add(self, seq, qual=None, lengths=None):
+        """
+        add a batch of records
+        :param seq: the sequences of records joined, bytes
+        :param qual: the qualities of records joined, bytes, None for fasta
+        :param lengths: the lengths of qualities of records, for the quality of cycles
+        :return:
+        """
+        self.bases = add_values(self.bases, count_bytes(seq))
+
+        if not qual:
+            return
+
+        self.quals = add_values(self.quals, count_bytes(qual))
+
+        if np is None or lengths is None:
+            return
+
+        # the cycle of each base is its position minus the start of its record
+        lengths = np.asarray(lengths, dtype=np.int64)
+        quals = np.frombuffer(qual, dtype=np.uint8)
+        cycles = np.arange(len(quals), dtype=np.int64) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        sums = np.bincount(cycles, weights=quals)
+
+        self.cycle_sums = add_values(self.cycle_sums, np.rint(sums).astype(np.uint64))
+        self.cycle_counts = add_values(self.cycle_counts, np.bincount(cycles))
+
+    def merge(self, other):
+        """
+        merge another summary into this one
+        :param other: QualityAccumulator
+        :return: self
+        """
+        self.bases = add_values(self.bases, other.bases)
+        self.quals = add_values(self.quals, other.quals)
+        self.cycle_sums = add_values(self.cycle_sums, other.cycle_sums)
+        self.cycle_counts = add_values(self.cycle_counts, other.cycle_counts)
+        self.cycles = self.cycles and other.cycles
+        return self
+
+    def count(self, letters):
+        return sum(int(self.bases[ord(i)]) for i in letters)
+
+    @property
+    def total(self):
+        return sum(int(i) for i in self.bases)
+
+    @property
+    def gc(self):
+        return self.count("GCgc")
+
+    @property
+    def n(self):
+        return self.count("Nn")
+
+    @property
+    def qual_total(self):
+        return sum(int(i) for i in self.quals)
+
+    def qual_sum(self):
+        return sum(int(j) * (i - QUALITY_OFFSET) for i, j in enumerate(self.quals) if j)
+
+    def over(self, quality):
+        """
+        return the number of bases with quality >= {quality}
+        """
+        return sum(int(i) for i in self.quals[quality + QUALITY_OFFSET:])
+
+    def write_cycles(self, fh):
+        """
+        write the mean quality of each cycle
+        :param fh: a file object
+        :return:
+        """
+        fh.write("#cycle\tbases\tmean_quality\n")
+
+        for i, (total, count) in enumerate(zip(self.cycle_sums, self.cycle_counts), 1):
+            if count:
+                fh.write("%s\t%s\t%.2f\n" % (i, count, 1.0 * int(total) / int(count) - QUALITY_OFFSET))
+
+    def dumps(self):
+        """
+        serialize the summary to bytes: the number of cycles, then counts
+        of bases and qualities, sums and counts of cycles as uint64
+        :return:
+        """
+        return b"".join([
+            QUALITY_MAGIC,
+            struct.pack("<QB", len(self.cycle_sums), self.cycles),
+            pack_values(self.bases),
+            pack_values(self.quals),
+            pack_values(self.cycle_sums),
+            pack_values(self.cycle_counts)
+        ])
+
+    @classmethod
+    def loads(cls, data):
+        """
+        load a summary from the bytes of dumps
+        :param data:
+        :return: QualityAccumulator
+        """
+        start = len(QUALITY_MAGIC) + 9
+
+        if data[:len(QUALITY_MAGIC)] != QUALITY_MAGIC or len(data) < start:
+            raise ValueError("Invalid quality summary")
+
+        n, cycles = struct.unpack("<QB", data[len(QUALITY_MAGIC):start])
+
+        if len(data) != start + 8 * (512 + 2 * n):
+            raise ValueError("Invalid quality summary")
+
+        values = [unpack_values(data[i:j]) for i, j in [
+            (start, start + 2048),
+            (start + 2048, start + 4096),
+            (start + 4096, start + 4096 + 8 * n),
+            (start + 4096 + 8 * n, len(data))
+        ]]
+
+        r = cls()
+        r.bases, r.quals, r.cycle_sums, r.cycle_counts = values
+        r.cycles = bool(cycles)
+        return r
@@ -2,30 +2,54 @@
 # -*- coding: utf-8 -*-
 
 import sys
+import heapq
 import os.path
 import argparse
 import logging
+import threading
+from queue import Queue
+from array import array
+from functools import partial
 from multiprocessing import Pool
 
 
-from seqkit.common import fofn2list, mkdir, touch, get_seq_format
-from seqkit.FastaReader import open_fasta
-from seqkit.FastqReader import open_fastq
+from seqkit.common import mkdir, touch, get_seq_format, get_task_parts, imap_tasks
+from seqkit.FastaReader import FastaIndex, check_fasta_chunk, get_chunk_id, read_fasta_chunks, yield_fasta_raw, \
+    has_index as has_fasta_index
+from seqkit.FastqReader import FastqIndex, yield_fastq_raw, has_index as has_fastq_index
+from seqkit.bgzf import is_bgzf
+from seqkit.stream import BLOCK_SIZE, COMPRESS_SUFFIX, TMP_SUFFIX, get_pipe_key, is_pipe, open_output, open_stream, \
+    put_queue
+from seqkit.metrics import collect, count_records, metrics_args
 from seqkit import __author__, __version__, __email__
 
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
 LOG = logging.getLogger(__name__)
+PART_BATCH_SIZE = 1 << 20
+WINDOW_WIDTH = 60
+PAIRED_BATCH_SIZE = 4096
+PAIRED_QUEUE_SIZE = 8
 
 
-def split_record(records, mode, number, out_fmt, out_bed=False, out_dir="split"):
+def split_record(records, mode, number, out_fmt, out_bed=False, out_dir="split", compress="none", level=6,
+                 threads=1):
     """
-
-    :param records:
+    write the original bytes of records to split files in large batches
+    :param records: (bytes of record, length of sequence)
     :param mode:
     :param number:
     :param out_fmt:
     :param out_bed:
     :param out_dir:
+    :param compress: none, gzip or bgzf
+    :param level: compression level
+    :param threads: the number of compression threads
     :return:
     """
     r = []
@@ -33,20 +57,26 @@ def split_record(records, mode, number, out_fmt, out_bed=False, out_dir="split")
 
     while True:
 
-        out_filename = os.path.join(out_dir, out_fmt.format(num=n))
+        out_filename = os.path.join(out_dir, out_fmt.format(num=n)) + COMPRESS_SUFFIX[compress]
 
-        out = open(out_filename, "w")
+        out = open_output(out_filename, compress, level, threads)
         beds = []
+        batch = []
+        batch_size = 0
 
         count = 0
 
-        for record in records:
-            id = record.id
-            length = len(record)
-            out.write(str(record) + "\n")
+        for raw, length in records:
+            batch.append(raw)
+            batch_size += len(raw)
+
+            if batch_size >= BLOCK_SIZE:
+                out.write(b"".join(batch))
+                batch = []
+                batch_size = 0
 
             if out_bed:
-                beds.append("%s\t1\t%s\n" % (id, length))
+                beds.append("%s\t1\t%s\n" % (get_chunk_id(raw), length))
 
             if mode == "length":
                 count += length
@@ -56,6 +86,7 @@ def split_record(records, mode, number, out_fmt, out_bed=False, out_dir="split")
             if count >= number:
                 break
 
+        out.write(b"".join(batch))
         out.close()
 
         if out_bed:
@@ -77,7 +108,121 @@ def split_record(records, mode, number, out_fmt, out_bed=False, out_dir="split")
     return r
 
 
-def split_file(filename, index, mode, number, out_dir="split"):
+def pack_lengths(lengths, parts):
+    """
+    assign records to parts balanced by bases, records are assigned from the
+    longest one to the part with the least bases (greedy bin packing)
+    :param lengths: an array of length
+    :param parts: the number of parts
+    :return: (the part of each record, the bases of each part, the records of each part)
+    """
+    if np is not None:
+        order = np.argsort(-np.frombuffer(lengths, dtype=np.uint64).astype(np.int64), kind="stable").tolist()
+    else:
+        order = sorted(range(len(lengths)), key=lengths.__getitem__, reverse=True)
+
+    assignment = array("I", bytes(4 * len(lengths)))
+    bases = [0] * parts
+    counts = [0] * parts
+    heap = [(0, i) for i in range(parts)]
+
+    for i in order:
+        total, part = heap[0]
+        assignment[i] = part
+        bases[part] = total + lengths[i]
+        counts[part] += 1
+        heapq.heapreplace(heap, (bases[part], part))
+
+    return assignment, bases, counts
+
+
+def split_parts(records, assignment, parts, out_fmt, out_bed=False, out_dir="split", compress="none", level=6,
+                threads=1):
+    """
+    write records to all parts at the same time, see pack_lengths
+    :param records: (bytes of record, length of sequence)
+    :param assignment: the part of each record, ValueError if records are more or less
+    :param parts: the number of parts
+    :param out_fmt:
+    :param out_bed:
+    :param out_dir:
+    :param compress: none, gzip or bgzf
+    :param level: compression level
+    :param threads: the number of compression threads
+    :return: the outputs and their numbers of records and bases
+    """
+    used = sorted(set(assignment))
+    names = [None] * parts
+    outs = [None] * parts
+    beds = [[] for i in range(parts)]
+    batches = [[] for i in range(parts)]
+    batch_sizes = [0] * parts
+    counts = [0] * parts
+    bases = [0] * parts
+
+    for n, i in enumerate(used, 1):
+        names[i] = os.path.join(out_dir, out_fmt.format(num=n)) + COMPRESS_SUFFIX[compress]
+        outs[i] = open_output(names[i], compress, level, threads)
+
+    records = iter(records)
+    number = 0
+
+    # assignment goes first, zip stops at its end without taking one more record
+    for i, (raw, length) in zip(assignment, records):
+        number += 1
+        batches[i].append(raw)
+        batch_sizes[i] += len(raw)
+        counts[i] += 1
+        bases[i] += length
+
+        if batch_sizes[i] >= PART_BATCH_SIZE:
+            outs[i].write(b"".join(batches[i]))
+            batches[i] = []
+            batch_sizes[i] = 0
+
+        if out_bed:
+            beds[i].append("%s\t1\t%s\n" % (get_chunk_id(raw), length))
+
+    if number != len(assignment) or next(records, None) is not None:
+        raise ValueError("The records are not the %s records packed into parts" % len(assignment))
+
+    r = []
+
+    for i in used:
+        outs[i].write(b"".join(batches[i]))
+        outs[i].close()
+
+        if out_bed:
+            with open(names[i] + ".bed", "w") as fh:
+                fh.write("%s\n" % "\n".join(beds[i]))
+
+        r.append((names[i], counts[i], bases[i]))
+
+    return r
+
+
+def get_out_fmt(filename):
+    """
+    get the format and the output name format of a sequence file
+    :param filename:
+    :return: (fmt, out_fmt)
+    """
+    prefix, fmt = get_seq_format(filename)
+
+    if fmt == "fasta":
+        out_fmt = "%s.{num}.fasta" % prefix
+    elif prefix.endswith(".R1"):
+        out_fmt = "%s_{num}.R1.fastq" % prefix.rstrip("R1")
+    elif prefix.endswith(".R2"):
+        out_fmt = "%s_{num}.R2.fastq" % prefix.rstrip("R2")
+    else:
+        out_fmt = "%s_{num}.fastq" % prefix
+
+    return fmt, out_fmt
+
+
+def split_file(filename, index, mode, number, out_dir="split", start=0, end=None, part=None,
+               compress="none", level=6, threads=1, window=1000000, overlap=0, window_out="fasta"):
     """
 
     :param filename:
@@ -85,34 +230,502 @@ def split_file(filename, index, mode, number, out_dir="split"):
     :param mode:
     :param number:
     :param out_dir:
+    :param start: the start offset of records
+    :param end: the end offset of records
+    :param part: the index of byte range, outputs are named with it to be renumbered later
+    :param compress: none, gzip or bgzf
+    :param level: compression level
+    :param threads: the number of compression threads
+    :param window: the size of window, for -m window
+    :param overlap: the size of overlap between windows, for -m window
+    :param window_out: write windows as fasta or bed, for -m window
     :return:
     """
     r = []
 
     LOG.info("%s process %r" % (index, filename))
-    prefix, fmt = get_seq_format(filename)
+    fmt, out_fmt = get_out_fmt(filename)
 
-    if fmt == "fasta":
-        r = split_record(open_fasta(filename), mode=mode, number=number,
-                         out_fmt="%s.{num}.fasta" % prefix, out_bed=True, out_dir=out_dir)
-    elif fmt == "fastq":
-
-        if prefix.endswith(".R1"):
-            prefix = "%s_{num}.R1.fastq" % prefix.rstrip("R1")
-        elif prefix.endswith(".R2"):
-            prefix = "%s_{num}.R2.fastq" % prefix.rstrip("R2")
+    if part is not None:
+        out_fmt = out_fmt.format(num="part%s-{num}" % part)
+
+    if mode == "parts":
+        return split_file_parts(filename, fmt, number, out_fmt, out_dir, compress, level, threads)
+    if mode == "window":
+        if fmt != "fasta":
+            raise ValueError("-m window only supports fasta, got %r" % filename)
+        return split_file_windows(filename, number, out_fmt, out_dir, window, overlap, window_out,
+                                  compress, level, threads)
+
+    with open_stream(filename, start, end) as stream:
+        if fmt == "fasta":
+            r = split_record(count_records(yield_fasta_raw(stream)), mode=mode, number=number,
+                             out_fmt=out_fmt, out_bed=True, out_dir=out_dir,
+                             compress=compress, level=level, threads=threads)
+        elif fmt == "fastq":
+            r = split_record(count_records(yield_fastq_raw(stream)), mode=mode, number=number,
+                             out_fmt=out_fmt, out_bed=False, out_dir=out_dir,
+                             compress=compress, level=level, threads=threads)
         else:
-            prefix = "%s_{num}.fastq" % prefix
+            LOG.info("??? seq format")  # will raise exception in get_seq_format
+
+    return r
+
+
+def yield_raw_records(stream, fmt):
+    """
+    yield the original bytes of records and the lengths of sequences
+    :param stream: a binary stream object
+    :param fmt: fasta or fastq
+    :return: (bytes of record, length of sequence)
+    """
+    if fmt == "fasta":
+        return yield_fasta_raw(stream)
+
+    return yield_fastq_raw(stream)
+
+
+def split_file_parts(filename, fmt, parts, out_fmt, out_dir="split", compress="none", level=6, threads=1):
+    """
+    split a file into parts balanced by bases, lengths are taken by the
+    same raw reader that writes the parts, a manifest of parts is written
+    :param filename:
+    :param fmt:
+    :param parts: the number of parts
+    :param out_fmt:
+    :param out_dir:
+    :param compress: none, gzip or bgzf
+    :param level: compression level
+    :param threads: the number of compression threads
+    :return:
+    """
+    with open_stream(filename) as stream:
+        lengths = array("Q", (length for raw, length in yield_raw_records(stream, fmt)))
+
+    assignment, bases, counts = pack_lengths(lengths, parts)
+    LOG.info("Pack %s records of %r into %s parts, bases of parts: %s-%s" % (
+        len(lengths), filename, parts, min(bases), max(bases)))
+
+    with open_stream(filename) as stream:
+        r = split_parts(count_records(yield_raw_records(stream, fmt)), assignment, parts, out_fmt, fmt == "fasta",
+                        out_dir, compress, level, threads)
+
+    write_manifest(os.path.join(out_dir, out_fmt.format(num="parts") + ".tsv"), r)
+
+    return [name for name, count, base in r]
+
+
+def write_manifest(filename, parts):
+    """
+    write the manifest of parts
+    :param filename:
+    :param parts: a list of (output, records, bases)
+    :return:
+    """
+    with open(filename, "w") as fh:
+        fh.write("#file\trecords\tbases\n")
+        for name, count, base in parts:
+            fh.write("%s\t%s\t%s\n" % (os.path.basename(name), count, base))
+
+
+def yield_windows(length, window, overlap=0):
+    """
+    yield windows of a sequence, neighbouring windows share {overlap} bases
+    :param length: the length of sequence
+    :param window: the size of window
+    :param overlap: the size of overlap, less than window
+    :return: (0-based start, end)
+    """
+    start = 0
+
+    while start < length:
+        end = min(start + window, length)
+        yield start, end
+
+        if end >= length:
+            break
+
+        start = end - overlap
+
+
+def yield_fasta_seqs(filename):
+    """
+    yield sequences of a fasta file, an uncompressed file with a .fai is
+    read by the mmap of its index, other files are read in a stream
+    :param filename:
+    :return: (id, length, function(start, end) return bytes of seq[start:end])
+    """
+    if use_fasta_index(filename):
+        with FastaIndex(filename) as index:
+            for name in index:
+                yield name, index.length(name), partial(index.fetch, name)
+        return
+
+    with open_stream(filename) as stream:
+        # the chunks are read here rather than by yield_fasta_raw, whose frame
+        # would keep the raw record next to its sequence while it is windowed
+        for chunk in read_fasta_chunks(stream):
+            if check_fasta_chunk(chunk) is None:
+                continue
+
+            name = get_chunk_id(chunk)
+            seq = chunk[chunk.find(b"\n")+1:].translate(None, b"\r\n \t")
+            del chunk
+            yield name, len(seq), partial(slice_bytes, seq)
 
-        r = split_record(open_fastq(filename), mode=mode, number=number,
-                         out_fmt=prefix, out_bed=False, out_dir=out_dir)
+
+def use_fasta_index(filename):
+    """
+    whether the windows of a fasta file are read by its .fai, an index is
+    never built here: it is written next to the input and needs lines of
+    the same width, use faidx to build one
+    """
+    return not filename.endswith(".gz") and has_fasta_index(filename)
+
+
+def slice_bytes(seq, start, end):
+    return seq[start:end]
+
+
+def format_window(name, start, end, seq, width=WINDOW_WIDTH):
+    """
+    format a window to a fasta record, named by samtools style region
+    :param name:
+    :param start: 0-based start
+    :param end:
+    :param seq: bytes
+    :param width: the line width of sequence
+    :return: bytes
+    """
+    lines = [b">%s:%d-%d" % (name.encode(), start + 1, end)]
+    lines.extend(seq[i:i+width] for i in range(0, len(seq), width))
+    lines.append(b"")
+
+    return b"\n".join(lines)
+
+
+def split_file_windows(filename, parts, out_fmt, out_dir="split", window=1000000, overlap=0, window_out="fasta",
+                       compress="none", level=6, threads=1):
+    """
+    cut sequences into windows and split the windows into parts with
+    continuous windows and balanced bases, windows are written as fasta
+    records or only as bed(0-based) regions
+    :param filename:
+    :param parts: the number of parts
+    :param out_fmt:
+    :param out_dir:
+    :param window: the size of window
+    :param overlap: the size of overlap between neighbouring windows
+    :param window_out: fasta or bed
+    :param compress: none, gzip or bgzf, for fasta
+    :param level: compression level
+    :param threads: the number of compression threads
+    :return:
+    """
+    if use_fasta_index(filename):
+        with FastaIndex(filename) as index:
+            seqs = [(name, index.length(name)) for name in index]
     else:
-        LOG.info("??? seq format")  # will raise exception in get_seq_format
+        with open_stream(filename) as stream:
+            seqs = [(get_chunk_id(raw), length) for raw, length in yield_fasta_raw(stream)]
+
+    if window_out == "fasta":
+        records = yield_fasta_seqs(filename)
+    else:
+        records = ((name, length, None) for name, length in seqs)
+
+    total = max(sum(end - start for name, length in seqs for start, end in yield_windows(length, window, overlap)), 1)
+    accu = 0
+    part = -1
+    out = bed = None
+    r = []
+
+    for name, length, fetch in records:
+        for start, end in yield_windows(length, window, overlap):
+            # a window goes to the part holding its middle base
+            i = min((2 * accu + end - start) * parts // (2 * total), parts - 1)
+            accu += end - start
+
+            if i != part:
+                if out:
+                    out.close()
+                if bed:
+                    bed.close()
+
+                part = i
+                out_filename = os.path.join(out_dir, out_fmt.format(num=len(r) + 1))
+
+                if window_out == "fasta":
+                    out_filename += COMPRESS_SUFFIX[compress]
+                    out = open_output(out_filename, compress, level, threads)
+                    r.append([out_filename, 0, 0])
+                else:
+                    r.append([out_filename + ".bed", 0, 0])
+
+                bed = open(out_filename + ".bed", "w")
+
+            if out:
+                out.write(format_window(name, start, end, fetch(start, end)))
+            bed.write("%s\t%s\t%s\n" % (name, start, end))
+            r[-1][1] += 1
+            r[-1][2] += end - start
+
+    if out:
+        out.close()
+    if bed:
+        bed.close()
+
+    write_manifest(os.path.join(out_dir, out_fmt.format(num="parts") + ".tsv"), r)
+
+    return [name for name, count, base in r]
+
+
+def get_mate_id(raw, size=256):
+    """
+    get the read id of a mate without the /1 or /2 suffix
+    :param raw: the bytes of record
+    :param size: the size of head searched for the first line
+    :return: bytes
+    """
+    head = bytes(raw[:size])
+
+    if b"\n" not in head:
+        head = bytes(raw)
+
+    name = (head[1:head.find(b"\n")].split(None, 1) or [b""])[0]
+
+    if name[-2:] in (b"/1", b"/2"):
+        name = name[:-2]
+
+    return name
+
+
+def read_mates(filename, queue, stop, batch_size=PAIRED_BATCH_SIZE):
+    """
+    parse a mate file to batches of (bytes of record, length, read id) in a
+    thread, a None is put at the end and an exception is put if failed
+    :param filename:
+    :param queue: a bounded queue
+    :param stop: a threading.Event to stop reading
+    :param batch_size: the number of records of each batch
+    :return:
+    """
+    try:
+        with open_stream(filename) as stream:
+            batch = []
+
+            for raw, length in yield_fastq_raw(stream):
+                batch.append((raw, length, get_mate_id(raw)))
+
+                if len(batch) >= batch_size:
+                    if not put_queue(queue, batch, stop):
+                        return
+                    batch = []
+
+            if batch and not put_queue(queue, batch, stop):
+                return
+
+        put_queue(queue, None, stop)
+    except Exception as e:
+        put_queue(queue, e, stop)
+
+
+def get_batch(queue):
+    batch = queue.get()
+
+    if isinstance(batch, Exception):
+        raise batch
+
+    return batch or []
+
+
+def yield_pairs(filename1, filename2):
+    """
+    read R1 and R2 in two threads and yield mates in lockstep,
+    read ids of mates are checked
+    :param filename1: R1
+    :param filename2: R2
+    :return: (bytes of R1, bytes of R2, bases of the pair)
+    """
+    queues = [Queue(PAIRED_QUEUE_SIZE), Queue(PAIRED_QUEUE_SIZE)]
+    stop = threading.Event()
+    readers = [threading.Thread(target=read_mates, args=(filename, queue, stop))
+               for filename, queue in zip([filename1, filename2], queues)]
+
+    for reader in readers:
+        reader.daemon = True
+        reader.start()
+
+    try:
+        while True:
+            batch1 = get_batch(queues[0])
+            batch2 = get_batch(queues[1])
+
+            for (raw1, length1, id1), (raw2, length2, id2) in zip(batch1, batch2):
+                if id1 != id2:
+                    raise ValueError("read ids of mates are different in %r and %r: %r, %r" % (
+                        filename1, filename2, id1.decode(), id2.decode()))
+
+                yield raw1, raw2, length1 + length2
+
+            if len(batch1) != len(batch2):
+                raise ValueError("%r and %r have different numbers of reads" % (filename1, filename2))
+            if not batch1:
+                break
+    finally:
+        stop.set()
+        for reader in readers:
+            reader.join()
+
+
+def split_pairs(pairs, mode, number, out_fmts, out_dir="split", compress="none", level=6, threads=1):
+    """
+    write mates to R1 and R2 split files with the same boundaries
+    :param pairs: (bytes of R1, bytes of R2, bases of the pair)
+    :param mode: number of pairs or length of pairs
+    :param number:
+    :param out_fmts: the output name formats of R1 and R2
+    :param out_dir:
+    :param compress: none, gzip or bgzf
+    :param level: compression level
+    :param threads: the number of compression threads
+    :return:
+    """
+    r = []
+    n = 1
+
+    while True:
+        out_filenames = [os.path.join(out_dir, out_fmt.format(num=n)) + COMPRESS_SUFFIX[compress]
+                         for out_fmt in out_fmts]
+        outs = [open_output(out_filename, compress, level, threads) for out_filename in out_filenames]
+        batches = [[], []]
+        batch_size = 0
+
+        count = 0
+
+        for raw1, raw2, length in pairs:
+            batches[0].append(raw1)
+            batches[1].append(raw2)
+            batch_size += len(raw1) + len(raw2)
+
+            if batch_size >= BLOCK_SIZE:
+                for out, batch in zip(outs, batches):
+                    out.write(b"".join(batch))
+                batches = [[], []]
+                batch_size = 0
+
+            if mode == "length":
+                count += length
+            else:
+                count += 1
+
+            if count >= number:
+                break
+
+        for out, batch in zip(outs, batches):
+            out.write(b"".join(batch))
+            out.close()
+
+        if count == 0:
+            for out_filename in out_filenames:
+                os.remove(out_filename)  # remove the empty file
+        else:
+            r += out_filenames
+
+        if count < number:
+            break
+
+        n += 1
 
     return r
 
 
-def seq_split(filenames, mode, num, output_dir, concurrent=1):
+def split_pair(filename1, filename2, index, mode, number, out_dir="split", compress="none", level=6, threads=1):
+    """
+    split paired-end files in lockstep, outputs of R1 and R2 are interleaved
+    :param filename1: R1
+    :param filename2: R2
+    :param index:
+    :param mode: number or length
+    :param number:
+    :param out_dir:
+    :param compress: none, gzip or bgzf
+    :param level: compression level
+    :param threads: the number of compression threads
+    :return:
+    """
+    LOG.info("%s process %r and %r" % (index, filename1, filename2))
+    fmt1, out_fmt1 = get_out_fmt(filename1)
+    fmt2, out_fmt2 = get_out_fmt(filename2)
+
+    if fmt1 != "fastq" or fmt2 != "fastq":
+        raise ValueError("--paired only supports fastq, got %r and %r" % (filename1, filename2))
+    if out_fmt1 == out_fmt2:
+        raise ValueError("outputs of %r and %r have the same names" % (filename1, filename2))
+
+    return split_pairs(count_records(yield_pairs(filename1, filename2)), mode, number, [out_fmt1, out_fmt2], out_dir,
+                       compress, level, threads)
+
+
+def renumber(filenames, out_fmt, out_dir="split", compress="none"):
+    """
+    rename the outputs of byte ranges of a file to continuous numbers
+    :param filenames: outputs in order
+    :param out_fmt:
+    :param out_dir:
+    :param compress: none, gzip or bgzf
+    :return: renamed outputs
+    """
+    r = []
+
+    for n, filename in enumerate(filenames, 1):
+        out_filename = os.path.join(out_dir, out_fmt.format(num=n)) + COMPRESS_SUFFIX[compress]
+        os.rename(filename, out_filename)
+
+        if os.path.exists(filename + ".bed"):
+            os.rename(filename + ".bed", out_filename + ".bed")
+
+        r.append(out_filename)
+
+    return r
+
+
+def get_split_ranges(filename, fmt, mode, num, concurrent=1, build_index=False, task_size=0):
+    """
+    cut a file into ranges for parallel split, only fastq files with an
+    index are cut for -m number, at multiples of {num} records; the last
+    output of any other range would end early, so -m length and other
+    files are split in one task
+    :param filename:
+    :param fmt:
+    :param mode:
+    :param num:
+    :param concurrent:
+    :param build_index: build the index of fastq if not exists
+    :param task_size: cut the file into ranges of about task_size bytes, see get_task_parts
+    :return: a list of (start, end)
+    """
+    if mode != "number" or fmt != "fastq":
+        return [(0, None)]
+
+    parts = get_task_parts(filename, concurrent, task_size)[0]
+
+    if parts <= 1 or (filename.endswith(".gz") and not is_bgzf(filename)):
+        return [(0, None)]
+
+    if has_fastq_index(filename):
+        fqi = FastqIndex(filename)
+    elif build_index:
+        fqi = FastqIndex.build(filename)
+    else:
+        return [(0, None)]
+
+    # each range holds whole output files, as a sequential run
+    return fqi.partition(parts, mode, num)
+
+
+def seq_split(filenames, mode, num, output_dir, concurrent=1, build_index=False, compress="none", level=6,
+              threads=1, window=1000000, overlap=0, window_out="fasta", paired=False, task_size=0, pool=None):
     """
     split fasta files, use multiprocess for parallel
     :param filenames: a list of fasta files
@@ -120,39 +733,162 @@ def seq_split(filenames, mode, num, output_dir, concurrent=1):
     :param num:
     :param output_dir: output directory
     :param concurrent: see -h
+    :param build_index: build the index of uncompressed or BGZF fastq for partition
+    :param compress: the compression of outputs, none, gzip or bgzf
+    :param level: compression level
+    :param threads: the number of compression threads of each process
+    :param window: the size of window, for -m window
+    :param overlap: the size of overlap between windows, for -m window
+    :param window_out: write windows as fasta or bed, for -m window
+    :param paired: filenames are R1 R2 pairs, split them in lockstep
+    :param task_size: cut large uncompressed or BGZF files into tasks of about task_size bytes
+    :param pool: a process pool to reuse, a new pool of {concurrent} processes if None
     :return:
     """
-    assert mode in ["number", "length"]
+    assert mode in ["number", "length", "parts", "window"]
+    assert 0 <= overlap < window, "the overlap must be less than the window"
+    assert not paired or mode in ["number", "length"], "--paired only supports -m number or length"
+    assert not paired or len(filenames) % 2 == 0, "--paired needs R1 R2 pairs of files"
     num = int(num)
 
+    for filename in filenames:
+        if is_pipe(filename) and mode in ["parts", "window"]:
+            raise ValueError("-m %s reads %r twice, but a pipe can be read only once" % (mode, filename))
+
     output_dir = mkdir(output_dir)
     split_list = os.path.join(output_dir, "split_list")
     done = os.path.join(output_dir, "split_done")
+    manifest = os.path.join(output_dir, "split_manifest")
+
+    # inputs finished in previous runs with the same fingerprint are not split again
+    params = "mode=%s,number=%s,compress=%s,level=%s,window=%s,overlap=%s,window_out=%s" % (
+        mode, num, compress, level, window, overlap, window_out)
+    finished = read_checkpoints(manifest)
+    remove_tmp_files(output_dir)
 
-    # avoid rerun
     if os.path.exists(done):
-        LOG.info("%r exists, pass this step; if you want to rerun, delete the file" % done)
-        return fofn2list(split_list)
+        os.remove(done)
 
     # for multiprocessing
-    pool = Pool(processes=concurrent)
-    results = []
+    if pool is None:
+        own_pool = pool = Pool(processes=concurrent)
+    else:
+        own_pool = None
 
     LOG.info("Split '{filenames}' by sequence {mode} =~ {num} per file".format(**locals()))
 
-    file_num = len(filenames)
+    if paired:
+        inputs = list(zip(filenames[0::2], filenames[1::2]))
+    else:
+        inputs = [(file, ) for file in filenames]
+
+    jobs = []
+    checkpoints = []
+
+    for files in inputs:
+        key = ",".join(get_pipe_key(file) if is_pipe(file) else os.path.abspath(file) for file in files)
+        fingerprint = get_fingerprint(files, params)
+        fmt, out_fmt = get_out_fmt(files[0])
+
+        if key in finished:
+            prev_fingerprint, outputs = finished[key]
+
+            # a pipe may bring other data in each run, it is always split again
+            if prev_fingerprint == fingerprint and all(os.path.exists(i) for i in outputs) \
+                    and not any(is_pipe(file) for file in files):
+                LOG.info("%r is finished in a previous run, skip it" % key)
+                jobs.append((key, fingerprint, files, fmt, out_fmt, outputs))
+                checkpoints.append((key, fingerprint, outputs))
+                continue
+
+            LOG.info("%r is changed or its outputs are missing, split it again" % key)
+            remove_outputs(outputs)
+
+        jobs.append((key, fingerprint, files, fmt, out_fmt, None))
+
+    write_checkpoints(manifest, checkpoints)
+
+    # cut indexed fastq files at records to use all processes,
+    # indexes are built in the same pool before the split
+    ranges = {}
+    range_jobs = []
+    pool_tasks = []
 
-    for i, file in enumerate(filenames):
-        index = "%s/%s" % (i+1, file_num)
-        results.append(pool.apply_async(split_file, (file, index, mode, num, output_dir)))
+    for j, (key, fingerprint, files, fmt, out_fmt, outputs) in enumerate(jobs):
+        if outputs is not None:
+            continue
+        if paired or is_pipe(files[0]):
+            ranges[j] = [(0, None)]
+            continue
 
-    pool.close()
-    pool.join()
+        range_jobs.append(j)
+        pool_tasks.append((os.path.getsize(files[0]), get_split_ranges, (
+            files[0], fmt, mode, num, concurrent, build_index, task_size)))
+
+    for i, r in imap_tasks(pool, pool_tasks, [jobs[j][0] for j in range_jobs]):
+        ranges[range_jobs[i]] = r
+
+    # each range is a task, the size of a task is estimated by the size of its file
+    tasks = []
+    labels = []
+    local = []
+    pool_tasks = []
+
+    for j in sorted(ranges):
+        key, fingerprint, files, fmt, out_fmt, outputs = jobs[j]
+        size = sum(0 if is_pipe(file) else os.path.getsize(file) for file in files) // len(ranges[j])
+
+        for part, (start, end) in enumerate(ranges[j]):
+            index = "%s/%s" % (len(tasks)+1, sum(len(i) for i in ranges.values()))
+            tasks.append((j, part))
+            labels.append(key)
+
+            # a pipe is read once by this process
+            if any(is_pipe(file) for file in files):
+                local.append(len(pool_tasks))
+
+            if paired:
+                # each pair is a job of one task, R1 and R2 are read by two threads of it
+                pool_tasks.append((size, split_pair, (files[0], files[1], index, mode, num, output_dir,
+                                                      compress, level, threads)))
+                continue
+
+            pool_tasks.append((size, split_file, (files[0], index, mode, num, output_dir,
+                                                  start, end, None if len(ranges[j]) == 1 else part,
+                                                  compress, level, threads, window, overlap, window_out)))
+
+    results = dict((j, [None] * len(ranges[j])) for j in ranges)
+    remains = dict((j, len(ranges[j])) for j in ranges)
+    outputs = dict((j, jobs[j][-1]) for j in range(len(jobs)) if j not in ranges)
+
+    # record each input as soon as all its tasks are finished
+    with open(manifest, "a") as fh:
+        for i, r in imap_tasks(pool, pool_tasks, labels, local):
+            j, part = tasks[i]
+            results[j][part] = r
+            remains[j] -= 1
+
+            if remains[j]:
+                continue
+
+            key, fingerprint, files, fmt, out_fmt, _ = jobs[j]
+            outputs[j] = [name for names in results[j] for name in names]
+
+            if len(ranges[j]) > 1:
+                outputs[j] = renumber(outputs[j], out_fmt, output_dir, compress)
+
+            LOG.info("%r is finished" % key)
+            fh.write(format_checkpoint(key, fingerprint, outputs[j]))
+            fh.flush()
+
+    if own_pool is not None:
+        own_pool.close()
+        own_pool.join()
 
     file_list = []
 
-    for r in results:
-        file_list += r.get()
+    for j in range(len(jobs)):
+        file_list += outputs[j]
 
     with open(split_list, "w") as fh:
         fh.write("\n".join(file_list))
@@ -161,20 +897,131 @@ def seq_split(filenames, mode, num, output_dir, concurrent=1):
     return file_list
 
 
+def get_fingerprint(filenames, params):
+    """
+    the fingerprint of inputs and options of a split job
+    :param filenames:
+    :param params: a string of options
+    :return:
+    """
+    r = []
+
+    for filename in filenames:
+        if is_pipe(filename):
+            r.append("pipe")
+            continue
+        st = os.stat(filename)
+        r.append("%s:%s" % (st.st_size, st.st_mtime_ns))
+
+    return "%s|%s" % (",".join(r), params)
+
+
+def format_checkpoint(key, fingerprint, outputs):
+    return "%s\n" % "\t".join([key, fingerprint] + list(outputs))
+
+
+def read_checkpoints(filename):
+    """
+    read the inputs finished in previous runs
+    :param filename: the manifest
+    :return: {inputs: (fingerprint, outputs)}
+    """
+    r = {}
+
+    if not os.path.exists(filename):
+        return r
+
+    with open(filename) as fh:
+        for line in fh:
+            # a line without newline is cut by a crash
+            if line.startswith("#") or not line.endswith("\n"):
+                continue
+
+            fields = line.rstrip("\n").split("\t")
+
+            if len(fields) >= 2:
+                r[fields[0]] = (fields[1], fields[2:])
+
+    return r
+
+
+def write_checkpoints(filename, checkpoints):
+    """
+    rewrite the manifest with the inputs still finished
+    :param filename:
+    :param checkpoints: a list of (inputs, fingerprint, outputs)
+    :return:
+    """
+    with open(filename + TMP_SUFFIX, "w") as fh:
+        fh.write("#inputs\tfingerprint\toutputs\n")
+        for key, fingerprint, outputs in checkpoints:
+            fh.write(format_checkpoint(key, fingerprint, outputs))
+
+    os.replace(filename + TMP_SUFFIX, filename)
+
+
+def remove_outputs(outputs):
+    """
+    remove the outputs of a stale input and their bed files
+    :param outputs:
+    :return:
+    """
+    for filename in outputs:
+        for name in [filename, filename + ".bed"]:
+            if os.path.exists(name):
+                os.remove(name)
+
+
+def remove_tmp_files(out_dir):
+    """
+    remove the partial outputs left by an interrupted run
+    :param out_dir:
+    :return:
+    """
+    for name in os.listdir(out_dir):
+        if name.endswith(TMP_SUFFIX):
+            LOG.info("Remove the partial output %r" % name)
+            os.remove(os.path.join(out_dir, name))
+
+
 def split_args(parser):
 
-    parser.add_argument("seq", metavar="FILES", nargs="+", help="files, '.gz' is accepted")
-    parser.add_argument("-m", "--mode", choices=["number", "length"], required=True, help="split by number or length")
+    parser.add_argument("seq", metavar="FILES", nargs="+", help="files, '.gz' is accepted, '-' or named pipes are read once in a stream")
+    parser.add_argument("-m", "--mode", choices=["number", "length", "parts", "window"], required=True,
+                        help="split by number or length per file, or into {number} parts balanced by length, "
+                             "or cut fasta into windows and split them into {number} parts")
     parser.add_argument("-n", "--number", type=int, required=True, metavar="INT", help="the value of mode")
     parser.add_argument("-o", "--output_dir", default="split", metavar="DIR", help="output directory")
-    parser.add_argument("-c", "--concurrent", metavar='INT', type=int, default=1, help="number of concurrent process")
+    parser.add_argument("-c", "--concurrent", metavar='INT', type=int, default=1,
+                        help="number of concurrent process, indexed fastq files are also cut at records for -m number")
+    parser.add_argument("--task_size", metavar="INT", type=int, default=0,
+                        help="cut indexed fastq files into tasks of about INT MB, "
+                             "0 to cut them into {concurrent} tasks")
+    parser.add_argument("--paired", action="store_true",
+                        help="input files are R1 R2 pairs, mates are split in lockstep by number or bases of pairs")
+    parser.add_argument("--index", action="store_true",
+                        help="build the index(.fqi) of uncompressed or BGZF fastq files to cut them by records for -m number")
+    parser.add_argument("--compress", choices=sorted(COMPRESS_SUFFIX), default="none",
+                        help="the compression of outputs, '.gz' is added to names")
+    parser.add_argument("--window", metavar="INT", type=int, default=1000000, help="the size of window")
+    parser.add_argument("--overlap", metavar="INT", type=int, default=0, help="the overlap between windows")
+    parser.add_argument("--window_out", choices=["fasta", "bed"], default="fasta",
+                        help="write windows as fasta records or only bed regions")
+    parser.add_argument("--level", metavar="INT", type=int, default=6, choices=range(10),
+                        help="compression level of outputs")
+    parser.add_argument("-t", "--threads", metavar="INT", type=int, default=1,
+                        help="number of compression threads of each process")
+    metrics_args(parser)
 
     return parser
 
 
 def split(args):
 
-    seq_split(args.seq, args.mode, args.number, args.output_dir, args.concurrent)
+    with collect(args.metrics, args.profile, "split"):
+        seq_split(args.seq, args.mode, args.number, args.output_dir, args.concurrent, args.index, args.compress,
+                  args.level, args.threads, args.window, args.overlap, args.window_out, args.paired,
+                  args.task_size << 20)
 
 
 def main():
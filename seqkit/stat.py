@@ -1,89 +1,358 @@
 #!/usr/bin/env python
 
+import os
 import sys
+import bisect
+import time
+import struct
 import argparse
 import logging
+import itertools
+from array import array
+from collections import Counter
 from multiprocessing import Pool
 
-from seqkit.FastqReader import open_fastq
-from seqkit.FastaReader import open_fasta
+from seqkit.FastqReader import yield_fastq_lengths
+from seqkit.FastaReader import FastaIndex, yield_fasta_lengths, has_index
+from seqkit.stream import STDIN, TMP_SUFFIX, is_pipe, open_stream
+from seqkit.cache import DEFAULT_CACHE_SIZE, StatCache
+from seqkit.quality import QualityAccumulator
+from seqkit.batch import iter_stream_batches
 from seqkit import __author__, __version__, __email__
-from seqkit.common import get_seq_format
+from seqkit.common import get_seq_format, get_task_ranges, imap_tasks
+from seqkit.metrics import collect, metrics_args, record_stage, record_task
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 
 LOG = logging.getLogger(__name__)
+SUMMARY_MAGIC = b"SKLEN\x01"
+PARTIAL_MAGIC = b"SKPART\x01"
+QUALITY_BATCH_SIZE = 4 << 20
 
 
-def get_length(filename, index, min_len):
+class LengthAccumulator(object):
     """
-    get the length of record
-    :param filename:
+    Exact summary of record lengths: the count of each distinct length,
+    filled while streaming and merged cheaply between processes
+    """
+    def __init__(self):
+        self._counts = Counter()
+        self._table = None
+
+    def add(self, lengths):
+        """
+        add lengths to the summary
+        :param lengths: an iterable of length
+        :return:
+        """
+        self._counts.update(lengths)
+        self._table = None
+
+    def merge(self, other):
+        """
+        merge another summary into this one
+        :param other: LengthAccumulator
+        :return: self
+        """
+        self._counts.update(other._counts)
+        self._table = None
+        return self
+
+    def items(self, reverse=False):
+        """
+        return (length, count) in order of length
+        :param reverse:
+        :return:
+        """
+        return sorted(self._counts.items(), reverse=reverse)
+
+    def table(self):
+        """
+        sort the distinct lengths once and return the prefix sums, all N and
+        >kb values are answered from them by binary search
+        :return: (lengths in ascending order, prefix sums of counts, prefix sums of bases)
+        """
+        if self._table is not None:
+            return self._table
+
+        items = self.items()
+
+        if np is not None:
+            lengths = np.array([i for i, j in items], dtype=np.uint64)
+            counts = np.array([j for i, j in items], dtype=np.uint64)
+            accu_nums = np.zeros(len(items) + 1, dtype=np.uint64)
+            accu_lens = np.zeros(len(items) + 1, dtype=np.uint64)
+            np.cumsum(counts, out=accu_nums[1:])
+            np.cumsum(lengths * counts, out=accu_lens[1:])
+        else:
+            lengths = [i for i, j in items]
+            accu_nums = [0]
+            accu_nums.extend(itertools.accumulate(j for i, j in items))
+            accu_lens = [0]
+            accu_lens.extend(itertools.accumulate(i * j for i, j in items))
+
+        self._table = lengths, accu_nums, accu_lens
+        return self._table
+
+    def select(self, min_len):
+        """
+        return a summary of lengths >= min_len
+        :param min_len:
+        :return: LengthAccumulator
+        """
+        r = LengthAccumulator()
+        r.add(dict((i, j) for i, j in self._counts.items() if i >= min_len))
+        return r
+
+    def dumps(self):
+        """
+        serialize the summary to bytes: the number of distinct lengths,
+        the lengths and their counts as little-endian uint64
+        :return:
+        """
+        items = self.items()
+        lengths = array("Q", [i for i, j in items])
+        counts = array("Q", [j for i, j in items])
+
+        if sys.byteorder != "little":
+            lengths.byteswap()
+            counts.byteswap()
+
+        return SUMMARY_MAGIC + struct.pack("<Q", len(items)) + lengths.tobytes() + counts.tobytes()
+
+    def __getstate__(self):
+        # pickled as the compact bytes of dumps between processes
+        return self.dumps()
+
+    def __setstate__(self, state):
+        self.__init__()
+        self.merge(LengthAccumulator.loads(state))
+
+    @classmethod
+    def loads(cls, data):
+        """
+        load a summary from the bytes of dumps
+        :param data:
+        :return: LengthAccumulator
+        """
+        start = len(SUMMARY_MAGIC) + 8
+
+        if data[:len(SUMMARY_MAGIC)] != SUMMARY_MAGIC or len(data) < start:
+            raise ValueError("Invalid length summary")
+
+        n = struct.unpack("<Q", data[len(SUMMARY_MAGIC):start])[0]
+
+        if len(data) != start + 16 * n:
+            raise ValueError("Invalid length summary")
+
+        lengths = array("Q", data[start:start+8*n])
+        counts = array("Q", data[start+8*n:])
+
+        if sys.byteorder != "little":
+            lengths.byteswap()
+            counts.byteswap()
+
+        r = cls()
+        r._counts.update(dict(zip(lengths, counts)))
+        return r
+
+    @property
+    def number(self):
+        return sum(self._counts.values())
+
+    @property
+    def total(self):
+        return sum(i * j for i, j in self._counts.items())
+
+    @property
+    def longest(self):
+        return max(self._counts) if self._counts else 0
+
+    def __len__(self):
+        return self.number
+
+    def N(self, number):
+        """
+        return N{number} information of lengths
+        :param number: 0-100
+        :return: (N{number}, number of records >= N{number}, sum of their lengths)
+        """
+        lengths, accu_nums, accu_lens = self.table()
+        assert len(lengths)
+
+        total = int(accu_lens[-1])
+        # the longest records in lengths[k:] are the shortest tail whose sum reaches the target
+        k = search(accu_lens, total*(100 - number)//100, "right") - 1
+        k = min(max(k, 0), len(lengths) - 1)
+
+        length = int(lengths[k])
+        above_num = int(accu_nums[-1]) - int(accu_nums[k+1])
+        above_len = total - int(accu_lens[k+1])
+        # the number of records with the length of N{number} needed to reach the target
+        count = -(-(total*number - above_len*100) // (length*100))
+        count = min(max(count, 1), int(accu_nums[k+1]) - int(accu_nums[k]))
+
+        return length, above_num + count, above_len + count*length
+
+    def over(self, number):
+        """
+        return length in lengths over {number}
+        :param number:
+        :return: (the first length below number, number of records >= number, sum of their lengths)
+        """
+        lengths, accu_nums, accu_lens = self.table()
+        assert len(lengths)
+
+        k = search(lengths, number)
+
+        return (int(lengths[max(k - 1, 0)]), int(accu_nums[-1]) - int(accu_nums[k]),
+                int(accu_lens[-1]) - int(accu_lens[k]))
+
+    def write(self, fh):
+        """
+        write lengths in descending order, one per line
+        :param fh: a file object
+        :return:
+        """
+        sep = ""
+
+        for length, count in self.items(reverse=True):
+            fh.write(("%s%s" % (sep, length)) + ("\n%s" % length) * (count - 1))
+            sep = "\n"
+
+
+def search(values, value, side="left"):
+    """
+    binary search on sorted values
+    :param values: sorted values
+    :param value:
+    :param side: left or right, see bisect
     :return:
     """
-    r = []
+    if np is not None:
+        return int(np.searchsorted(values, value, side))
+    elif side == "left":
+        return bisect.bisect_left(values, value)
+    else:
+        return bisect.bisect_right(values, value)
+
+
+def get_length(filename, index, min_len, start=0, end=None):
+    """
+    get the length summary of records
+    :param filename:
+    :param index:
+    :param min_len:
+    :param start: the start offset of records
+    :param end: the end offset of records
+    :return: LengthAccumulator
+    """
+    r = LengthAccumulator()
 
     LOG.info("%s process %r" % (index, filename))
 
     prefix, fmt = get_seq_format(filename)
 
-    if fmt == "fasta":
-        records = open_fasta(filename)
+    if fmt == "fasta" and has_index(filename):
+        LOG.info("Read lengths from the index of %r" % filename)
+        lengths = FastaIndex(filename).lengths()
+        if min_len > 0:
+            lengths = filter(min_len.__le__, lengths)
+        r.add(lengths)
+        record_task(records=r.number)
+        return r
+    elif fmt == "fasta":
+        yield_lengths = yield_fasta_lengths
     elif fmt == "fastq":
-        records = open_fastq(filename)
+        yield_lengths = yield_fastq_lengths
     else:
         LOG.info("%r is not a valid seq format!" % filename)
-        records = []
+        return r
+
+    with open_stream(filename, start, end) as stream:
+        for lengths in yield_lengths(stream):
+            if min_len > 0:
+                lengths = filter(min_len.__le__, lengths)
+            r.add(lengths)
 
-    for record in records:
-        length = len(record)
-        if length >= min_len:
-            r.append(length)
+    record_task(records=r.number)
 
     return r
 
 
-def N(number, lengths):
+def get_quality(filename, index, start=0, end=None):
     """
-    return N{number} information of lengths
-    :param number: 0-100
-    :param lengths: a list of length
-    :return:
+    get the length summary and the base composition and quality summary of records
+    :param filename:
+    :param index:
+    :param start: the start offset of records
+    :param end: the end offset of records
+    :return: (LengthAccumulator, QualityAccumulator)
     """
-    assert lengths
+    lengths = LengthAccumulator()
+    quality = QualityAccumulator()
+
+    LOG.info("%s process %r" % (index, filename))
 
-    sum_length = sum(lengths)
-    accu_len = 0
-    accu_num = 0
+    prefix, fmt = get_seq_format(filename)
 
-    for i in sorted(lengths, reverse=True):
-        accu_len += i
-        accu_num += 1
+    with open_stream(filename, start, end) as stream:
+        for batch in iter_stream_batches(stream, fmt, QUALITY_BATCH_SIZE, QUALITY_BATCH_SIZE, ids=False):
+            lengths.add(batch.lengths)
+            quality.add(batch.seq, batch.qual, batch.lengths)
 
-        if accu_len >= sum_length*number/100:
-            return i, accu_num, accu_len
+    record_task(records=lengths.number)
 
-    return i, accu_num, accu_len
+    return lengths, quality
 
 
-def over(number, lengths):
+def get_summary_bytes(filename, index, start=0, end=None, quality=False):
     """
-    return length in lengths over {number}
-    :param number:
-    :param lengths:
+    get the summary of records as the bytes of dump_summary,
+    used as the task of the process pool
+    :param filename:
+    :param index:
+    :param start: the start offset of records
+    :param end: the end offset of records
+    :param quality: get the base composition and quality summary
     :return:
     """
-    assert lengths
-    accu_len = 0
-    accu_num = 0
+    if quality:
+        return dump_summary(*get_quality(filename, index, start, end))
+
+    return dump_summary(get_length(filename, index, 0, start, end))
+
+
+def dump_summary(lengths, quality=None):
+    """
+    serialize a length summary and an optional quality summary
+    :param lengths: LengthAccumulator
+    :param quality: QualityAccumulator or None
+    :return:
+    """
+    return lengths.dumps() + (quality.dumps() if quality is not None else b"")
+
+
+def load_summary(data):
+    """
+    load the bytes of dump_summary
+    :param data:
+    :return: (LengthAccumulator, QualityAccumulator or None)
+    """
+    start = len(SUMMARY_MAGIC) + 8
 
-    for i in sorted(lengths, reverse=True):
-        if i < number:
-            return i, accu_num, accu_len
+    if len(data) < start:
+        raise ValueError("Invalid length summary")
 
-        accu_len += i
-        accu_num += 1
+    size = start + 16 * struct.unpack("<Q", data[len(SUMMARY_MAGIC):start])[0]
+    lengths = LengthAccumulator.loads(data[:size])
+    quality = QualityAccumulator.loads(data[size:]) if len(data) > size else None
 
-    return i, accu_num, accu_len
+    return lengths, quality
 
 
 def fofn2list(fofn):
@@ -103,7 +372,8 @@ def fofn2list(fofn):
 
 def seq_stat(filenames, ngs=False, fofn=False, concurrent=1, min_len=0,
              ns=(10, 20, 30, 40, 50, 60, 70, 80, 90),
-             ls=(1, 5, 10, 20, 30, 40, 50, 60)):
+             ls=(1, 5, 10, 20, 30, 40, 50, 60), cache_dir=None, cache_size=DEFAULT_CACHE_SIZE, partial=None,
+             task_size=0, pool=None, quality=False):
     """
     statistics on sequence files
     :param filenames:
@@ -112,6 +382,12 @@ def seq_stat(filenames, ngs=False, fofn=False, concurrent=1, min_len=0,
     :param min_len:
     :param ns:
     :param ls:
+    :param cache_dir: the directory to cache the lengths of each file
+    :param cache_size: the max size of cache in bytes
+    :param partial: write a partial summary to the file instead of the report, see merge_stat
+    :param task_size: cut uncompressed or BGZF files into tasks of about task_size bytes
+    :param pool: a process pool to reuse, a new pool of {concurrent} processes if None
+    :param quality: also get the base composition and quality of all records
     :return:
     """
     # 1. get the lengths of each fastA/Q file
@@ -122,32 +398,229 @@ def seq_stat(filenames, ngs=False, fofn=False, concurrent=1, min_len=0,
     else:
         file_list = filenames
 
-    pool = Pool(processes=concurrent)
-    results = []
+    cache = StatCache(cache_dir, cache_size) if cache_dir else None
+    cache_keys = {}
+    summaries = {}
+
+    # cut large uncompressed files into byte ranges to use all processes
+    tasks = []
+
+    for filename in file_list:
+        if filename in summaries:
+            continue
+
+        prefix, fmt = get_seq_format(filename)
+        summaries[filename] = [LengthAccumulator(), QualityAccumulator() if quality else None]
+
+        # a pipe has no size and mtime to be cached
+        if cache is not None and not is_pipe(filename):
+            cache_keys[filename] = StatCache.get_key(filename, get_cache_format(fmt, quality))
+            data = cache.get(cache_keys[filename])
+            if data is not None:
+                LOG.info("Read the summary of %r from cache" % filename)
+                summaries[filename] = list(load_summary(data))
+                continue
+
+        if fmt == "fasta" and has_index(filename) and not quality:
+            ranges = [(0, None)]
+        else:
+            ranges = get_task_ranges(filename, fmt, concurrent, task_size)
+
+        # the size of a task is estimated by the size of its file
+        size = 0 if is_pipe(filename) else os.path.getsize(filename) // len(ranges)
+
+        for start, end in ranges:
+            tasks.append((filename, size, start, end))
+
+    if pool is None:
+        own_pool = pool = Pool(processes=concurrent)
+    else:
+        own_pool = None
+
+    remains = Counter(filename for filename, size, start, end in tasks)
+    received = 0
+    load_time = 0
+
+    # the lengths are filtered by min_len after merged, so the summaries of files can be cached
+    pool_tasks = []
 
-    for i in range(len(file_list)):
-        filename = file_list[i]
-        index = "%s/%s" % (i+1, len(file_list))
-        results.append(pool.apply_async(get_length, (filename, index, min_len)))
+    for i, (filename, size, start, end) in enumerate(tasks):
+        index = "%s/%s" % (i+1, len(tasks))
+        pool_tasks.append((size, get_summary_bytes, (filename, index, start, end, quality)))
 
-    pool.close()
-    pool.join()
+    # a pipe is read once by this process
+    local = [i for i, task in enumerate(tasks) if is_pipe(task[0])]
 
-    lengths = []
+    for i, data in imap_tasks(pool, pool_tasks, [filename for filename, size, start, end in tasks], local):
+        filename = tasks[i][0]
+        start_time = time.time()
+        received += len(data)
+        lengths, qual = load_summary(data)
+        summaries[filename][0].merge(lengths)
+        if quality:
+            summaries[filename][1].merge(qual)
+        load_time += time.time() - start_time
+        remains[filename] -= 1
 
-    for i, r in enumerate(results):
-        LOG.info("%s/%s getting results of %r" % (i+1, len(results), file_list[i]))
-        lengths += r.get()
+        if filename in cache_keys and not remains[filename]:
+            cache.put(cache_keys[filename], dump_summary(*summaries[filename]))
 
-    # write lengths out
-    lengths = sorted(lengths, reverse=True)
+    if own_pool is not None:
+        own_pool.close()
+        own_pool.join()
 
+    if tasks:
+        LOG.info("Received %s bytes of summaries from %s tasks, loaded in %.3fs" % (
+            received, len(tasks), load_time))
+        record_stage("load", calls=len(tasks), wall=load_time, bytes_in=received)
+
+    if partial:
+        LOG.info("Write the partial summary of %s files to %r" % (len(file_list), partial))
+        write_partial(partial, [(filename, summaries[filename]) for filename in file_list])
+        return 0
+
+    lengths = LengthAccumulator()
+    qual = QualityAccumulator() if quality else None
+
+    for filename in file_list:
+        lengths.merge(summaries[filename][0])
+        if quality:
+            qual.merge(summaries[filename][1])
+
+    if min_len > 0:
+        lengths = lengths.select(min_len)
+
+    return print_stat(lengths, len(file_list), ngs, ns, ls, qual)
+
+
+def get_cache_format(fmt, quality=False):
+    """
+    the format in cache keys, summaries with quality are cached apart
+    """
+    return "%s+quality" % fmt if quality else fmt
+
+
+def write_partial(filename, summaries):
+    """
+    write a binary partial summary: the magic, the size of metadata, the
+    metadata of files in tsv(path, size, mtime, format, records, bases)
+    and the merged summary of all files, a pipe has "-" as its size and mtime
+    :param filename:
+    :param summaries: a list of (file, (LengthAccumulator, QualityAccumulator or None))
+    :return:
+    """
+    lengths = LengthAccumulator()
+    quality = None
+    meta = []
+
+    for path, (summary, qual) in summaries:
+        if is_pipe(path):
+            # a pipe is read once and has no size and mtime
+            name, size, mtime = path if path == STDIN else os.path.abspath(path), "-", "-"
+        else:
+            st = os.stat(path)
+            name, size, mtime = os.path.abspath(path), st.st_size, st.st_mtime_ns
+
+        meta.append("%s\t%s\t%s\t%s\t%s\t%s\n" % (name, size, mtime, get_seq_format(path)[1],
+                                                 summary.number, summary.total))
+        lengths.merge(summary)
+        if qual is not None:
+            quality = qual if quality is None else quality.merge(qual)
+
+    meta = "".join(meta).encode()
+
+    with open(filename + TMP_SUFFIX, "wb") as fh:
+        fh.write(PARTIAL_MAGIC + struct.pack("<Q", len(meta)))
+        fh.write(meta)
+        fh.write(dump_summary(lengths, quality))
+
+    os.replace(filename + TMP_SUFFIX, filename)
+
+
+def read_partial(filename):
+    """
+    read a partial summary written by write_partial
+    :param filename:
+    :return: (a list of metadata of files, LengthAccumulator, QualityAccumulator or None)
+    """
+    with open(filename, "rb") as fh:
+        data = fh.read()
+
+    start = len(PARTIAL_MAGIC) + 8
+
+    if data[:len(PARTIAL_MAGIC)] != PARTIAL_MAGIC or len(data) < start:
+        raise ValueError("%r is not a partial summary of stat" % filename)
+
+    size = struct.unpack("<Q", data[len(PARTIAL_MAGIC):start])[0]
+    meta = [line.split("\t") for line in data[start:start+size].decode().splitlines()]
+    lengths, quality = load_summary(data[start+size:])
+
+    if lengths.number != sum(int(i[4]) for i in meta) or lengths.total != sum(int(i[5]) for i in meta):
+        raise ValueError("%r is broken, the summary does not match its files" % filename)
+
+    return meta, lengths, quality
+
+
+def merge_stat(filenames, ngs=False, fofn=False, min_len=0,
+               ns=(10, 20, 30, 40, 50, 60, 70, 80, 90),
+               ls=(1, 5, 10, 20, 30, 40, 50, 60)):
+    """
+    merge partial summaries and print the report of all their files
+    :param filenames: partial summaries written by stat --partial
+    :param fofn: a file contain partial summary list
+    :param min_len:
+    :param ns:
+    :param ls:
+    :return:
+    """
+    if fofn:
+        file_list = []
+        for f in filenames:
+            file_list += fofn2list(f)
+    else:
+        file_list = filenames
+
+    lengths = LengthAccumulator()
+    quality = QualityAccumulator()
+    file_num = 0
+
+    for i, filename in enumerate(file_list):
+        LOG.info("%s/%s merge %r" % (i+1, len(file_list), filename))
+        meta, summary, qual = read_partial(filename)
+        lengths.merge(summary)
+        file_num += len(meta)
+
+        # the quality is reported only if all partials have it
+        if qual is None:
+            quality = None
+        elif quality is not None:
+            quality.merge(qual)
+
+    if min_len > 0:
+        lengths = lengths.select(min_len)
+
+    return print_stat(lengths, file_num, ngs, ns, ls, quality)
+
+
+def print_stat(lengths, file_num, ngs=False,
+               ns=(10, 20, 30, 40, 50, 60, 70, 80, 90),
+               ls=(1, 5, 10, 20, 30, 40, 50, 60), quality=None):
+    """
+    print the statistics of lengths and write record.len
+    :param lengths: LengthAccumulator
+    :param file_num: the number of files
+    :param ngs:
+    :param ns:
+    :param ls:
+    :param quality: QualityAccumulator, print the composition and quality and write record.qual
+    :return:
+    """
     # 2. get the common statistics
-    total_length = sum(lengths)
-    reads_number = len(lengths)
-    file_num = "{0:,}".format(len(file_list))
+    total_length = lengths.total
+    reads_number = lengths.number
+    file_num = "{0:,}".format(file_num)
     average_length = "{0:,}".format(int(total_length / reads_number))
-    longest = "{0:,}".format(lengths[0])
+    longest = "{0:,}".format(lengths.longest)
     _total_length = "{0:,}".format(total_length)
     reads_number = "{0:,}".format(reads_number)
 
@@ -161,6 +634,9 @@ average length:\t{average_length}
 longest length:\t{longest}
 """.format(**locals()))
 
+    if quality is not None:
+        print_quality(quality)
+
     # 2. get the N10-N90 statstics
     # length: the N{i} value; number: number of reads which length >= N{i}
     # if the input file is ngs short reads, skip the following steps.
@@ -170,7 +646,7 @@ longest length:\t{longest}
     print("Distribution of record length")
     print("%5s\t%15s\t%15s\t%10s" % ("Type", "Bases", "Count", "%Bases"))
     for i in ns:
-        read_length, read_number, read_length_sum = N(i, lengths)
+        read_length, read_number, read_length_sum = lengths.N(i)
         print("%5s\t%15s\t%15s\t%10.2f" % ("N%s" % i,
                                            "{0:,}".format(read_length),
                                            "{0:,}".format(read_number),
@@ -178,7 +654,7 @@ longest length:\t{longest}
 
     # length: the sum of record length which length >= i; number: the number of record which length >= i
     for i in ls:
-        _, read_number, read_length_sum = over(i*1000, lengths)
+        _, read_number, read_length_sum = lengths.over(i*1000)
         print("%5s\t%15s\t%15s\t%10.2f" % (">%skb" % i,
                                            "{0:,}".format(read_length_sum),
                                            "{0:,}".format(read_number),
@@ -186,7 +662,35 @@ longest length:\t{longest}
 
     # write out record length for plot
     with open("record.len", "w") as fh:
-        fh.write("\n".join(map(str, lengths)))
+        lengths.write(fh)
+
+
+def print_quality(quality):
+    """
+    print the base composition and quality of all records, the mean quality
+    of each cycle is written to record.qual
+    :param quality: QualityAccumulator
+    :return:
+    """
+    total = max(quality.total, 1)
+
+    print("Composition of bases")
+    print("GC content:    \t%.2f%%" % (100.0 * quality.gc / total))
+    print("N rate:        \t%.4f%%" % (100.0 * quality.n / total))
+
+    if quality.qual_total:
+        qual_total = quality.qual_total
+        print("mean quality:  \t%.2f" % (1.0 * quality.qual_sum() / qual_total))
+        print("Q20 bases:     \t%.2f%%" % (100.0 * quality.over(20) / qual_total))
+        print("Q30 bases:     \t%.2f%%" % (100.0 * quality.over(30) / qual_total))
+
+        if quality.cycles:
+            with open("record.qual", "w") as fh:
+                quality.write_cycles(fh)
+        else:
+            LOG.info("numpy is not installed, the quality of cycles is not counted")
+
+    print("")
 
 
 def stat_args(parser):
@@ -195,22 +699,42 @@ def stat_args(parser):
     :return:
     """
 
-    parser.add_argument("input", metavar='FILEs', nargs="+", help="files, '.gz' is accepted")
+    parser.add_argument("input", metavar='FILEs', nargs="+", help="files, '.gz' is accepted, '-' or named pipes are read once in a stream")
     parser.add_argument("-ngs", action="store_true", help="input fastq reads is short reads from ngs")
     parser.add_argument("-f", "--fofn", action="store_true", help="input file contains file paths")
     parser.add_argument("--min_len", type=int, metavar="INT", default=0, help="min length to statistics")
     parser.add_argument("-c", "--concurrent", metavar='INT', type=int, default=1, help="number of concurrent process")
+    parser.add_argument("--task_size", metavar="INT", type=int, default=0,
+                        help="cut large uncompressed or BGZF files into tasks of about INT MB, "
+                             "0 to cut them into {concurrent} tasks")
+    parser.add_argument("--qual", action="store_true",
+                        help="also count GC, N, mean quality and Q20/Q30 of all records, "
+                             "the mean quality of each cycle is written to record.qual")
     parser.add_argument("--ns", metavar="INT", type=int, nargs="+", default=[10, 20, 30, 40, 50, 60, 70, 80, 90],
                       help="the values of N* to show")
     parser.add_argument("--ls", metavar="INT", type=int, nargs="+", default=[1, 5, 10, 20, 30, 40, 50, 60],
                       help="the values of >*kb to show")
+    parser.add_argument("--cache", metavar="DIR", default=None,
+                        help="cache the lengths of each file in DIR, unchanged files are not read again")
+    parser.add_argument("--cache_size", metavar="INT", type=int, default=DEFAULT_CACHE_SIZE >> 20,
+                        help="the max size(MB) of cache, the least recently used files are removed")
+    parser.add_argument("--partial", metavar="FILE", default=None,
+                        help="write a binary partial summary to FILE instead of the report, merged by --merge")
+    parser.add_argument("--merge", action="store_true",
+                        help="input files are partial summaries, merge them to the report of all their files")
+    metrics_args(parser)
 
     return parser
 
 
 def stat(args):
 
-    seq_stat(args.input, args.ngs, args.fofn, args.concurrent, args.min_len, args.ns, args.ls)
+    with collect(args.metrics, args.profile, "stat"):
+        if args.merge:
+            merge_stat(args.input, args.ngs, args.fofn, args.min_len, args.ns, args.ls)
+        else:
+            seq_stat(args.input, args.ngs, args.fofn, args.concurrent, args.min_len, args.ns, args.ls,
+                     args.cache, args.cache_size << 20, args.partial, args.task_size << 20, quality=args.qual)
 
 
 def main():
@@ -0,0 +1,625 @@
+
+import io
+import os
+import sys
+import bz2
+import gzip
+import lzma
+import stat
+import time
+import atexit
+import logging
+import weakref
+import threading
+from queue import Empty, Full, Queue
+from functools import partial
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from seqkit.bgzf import BGZF_EOF, MAX_BLOCK_DATA, BgzfReader, deflate_blocks, find_block, is_bgzf
+from seqkit.metrics import record_stage
+
+LOG = logging.getLogger(__name__)
+COMPRESS_SUFFIX = {"none": "", "gzip": ".gz", "bgzf": ".gz"}
+BLOCK_SIZE = 4 << 20
+SYNC_SIZE = 1 << 20
+MIN_RANGE_SIZE = 64 << 20
+TMP_SUFFIX = ".tmp"
+READ_AHEAD_DEPTH = 4
+READ_AHEAD_SIZE = BLOCK_SIZE
+STDIN = "-"
+SNIFF_SIZE = 64
+MAGICS = [(b"\x1f\x8b", "gzip"), (b"BZh", "bz2"), (b"\xfd7zXZ\x00", "xz")]
+
+# the sniffed streams and formats of pipes, a pipe can be read only once, see sniff_pipe
+_PIPE_STREAMS = {}
+_PIPE_FORMATS = {}
+# the open read-ahead readers, closed at exit before their daemon threads are frozen
+_READERS = weakref.WeakSet()
+
+
+class RangeReader(io.RawIOBase):
+    """
+    a raw stream limited to the byte range [start, end) of a file
+    """
+    def __init__(self, fh, start=0, end=None):
+        self._fh = fh
+        self._fh.seek(start)
+        self._left = float("inf") if end is None else end - start
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        size = min(len(b), self._left)
+
+        if size <= 0:
+            return 0
+
+        n = self._fh.readinto(memoryview(b)[:size])
+        self._left -= n
+        return n
+
+    def close(self):
+        self._fh.close()
+        super(RangeReader, self).close()
+
+
+def put_queue(queue, item, stop):
+    """
+    put an item to a bounded queue until stop is set
+    :param queue:
+    :param item:
+    :param stop: a threading.Event
+    :return: False if stopped
+    """
+    while not stop.is_set():
+        try:
+            queue.put(item, timeout=0.1)
+            return True
+        except Full:
+            pass
+
+    return False
+
+
+def read_ahead(stream, queue, stop, size, stats):
+    """
+    read blocks of a stream into a queue until the end of stream or stop is set,
+    an empty block is put at the end and an exception is put if failed
+    :param stream: a binary stream object
+    :param queue: a bounded queue
+    :param stop: a threading.Event
+    :param size: the size of blocks
+    :param stats: a dict to add the time waiting for the queue to "full_time", the time
+                  reading(I/O and inflation) to "read_time", its cpu time to "read_cpu" and
+                  the bytes read to "bytes"
+    :return:
+    """
+    cpu = time.thread_time()
+
+    try:
+        while True:
+            start = time.time()
+            data = stream.read(size)
+            stats["read_time"] += time.time() - start
+            stats["bytes"] += len(data)
+            start = time.time()
+
+            if not put_queue(queue, data, stop) or not data:
+                break
+
+            stats["full_time"] += time.time() - start
+    except Exception as e:
+        put_queue(queue, e, stop)
+    finally:
+        stats["read_cpu"] = time.thread_time() - cpu
+
+
+class ReadAheadReader(io.RawIOBase):
+    """
+    read blocks of a stream in a producer thread into a bounded queue, so
+    inflation and I/O run while the parser consumes the previous blocks;
+    stalls: the times the reader waited for a block, stall_time: the time
+    the reader waited, full_time: the time the producer waited for the reader
+    """
+    def __init__(self, stream, depth=READ_AHEAD_DEPTH, size=READ_AHEAD_SIZE):
+        self._stream = stream
+        self._queue = Queue(max(depth, 1))
+        self._stop = threading.Event()
+        self._stats = {"full_time": 0.0, "read_time": 0.0, "read_cpu": 0.0, "bytes": 0}
+        self._data = memoryview(b"")
+        self._pos = 0
+        self._eof = False
+        self.stalls = 0
+        self.stall_time = 0.0
+        # the thread does not refer to the reader, so a dropped reader is closed by gc
+        self._thread = threading.Thread(target=read_ahead,
+                                        args=(stream, self._queue, self._stop, size, self._stats))
+        self._thread.daemon = True
+        self._thread.start()
+        _READERS.add(self)
+
+    @property
+    def full_time(self):
+        return self._stats["full_time"]
+
+    def _next_block(self):
+        try:
+            data = self._queue.get_nowait()
+        except Empty:
+            start = time.time()
+            data = self._queue.get()
+            self.stalls += 1
+            self.stall_time += time.time() - start
+
+        if isinstance(data, Exception):
+            raise data
+        if not data:
+            self._eof = True
+            return False
+
+        self._data = memoryview(data)
+        self._pos = 0
+        return True
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if self._pos >= len(self._data) and (self._eof or not self._next_block()):
+            return 0
+
+        n = min(len(b), len(self._data) - self._pos)
+        b[:n] = self._data[self._pos:self._pos+n]
+        self._pos += n
+
+        return n
+
+    def close(self):
+        if self.closed:
+            return
+
+        self._stop.set()
+        self._thread.join()
+        self._stream.close()
+        LOG.debug("Read-ahead stalled %s times, %.3fs waiting for data, %.3fs waiting for the parser" % (
+            self.stalls, self.stall_time, self.full_time))
+        record_stage("read", calls=1, wall=self._stats["read_time"], cpu=self._stats["read_cpu"],
+                     bytes_out=self._stats["bytes"], stalls=self.stalls, stall_time=self.stall_time,
+                     full_time=self.full_time)
+        super(ReadAheadReader, self).close()
+
+
+@atexit.register
+def _close_readers():
+    # a reader closed by gc at shutdown would wait for the lock of a frozen thread
+    for reader in list(_READERS):
+        reader.close()
+
+
+class PrefixReader(io.RawIOBase):
+    """
+    a raw stream of the bytes already read from a stream followed by the rest of the stream
+    """
+    def __init__(self, head, stream):
+        self._head = memoryview(head)
+        self._stream = stream
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if self._head:
+            n = min(len(b), len(self._head))
+            b[:n] = self._head[:n]
+            self._head = self._head[n:]
+            return n
+
+        return self._stream.readinto(b)
+
+    def close(self):
+        if self.closed:
+            return
+
+        self._stream.close()
+        super(PrefixReader, self).close()
+
+
+def is_pipe(filename):
+    """
+    stdin("-") or a named pipe, which is read only once and in order
+    :param filename:
+    :return:
+    """
+    if filename == STDIN:
+        return True
+
+    try:
+        return stat.S_ISFIFO(os.stat(filename).st_mode)
+    except OSError:
+        return False
+
+
+def get_pipe_key(filename):
+    return filename if filename == STDIN else os.path.abspath(filename)
+
+
+def read_head(stream, size=SNIFF_SIZE):
+    """
+    read the first size bytes of stream, less at the end of stream
+    """
+    r = b""
+
+    while len(r) < size:
+        data = stream.read(size - len(r))
+        if not data:
+            break
+        r += data
+
+    return r
+
+
+def sniff_pipe(filename):
+    """
+    open stdin("-") or a named pipe, detect its compression(gzip, bgzf, bz2 or xz)
+    by the magic and its format by the first character of data(">" or "@"),
+    the bytes read are kept for the next open_stream of the pipe
+    :param filename:
+    :return: (compression, fasta or fastq)
+    """
+    key = get_pipe_key(filename)
+
+    if key in _PIPE_FORMATS:
+        return _PIPE_FORMATS[key]
+
+    fh = sys.stdin.buffer if key == STDIN else open(key, "rb")
+    head = read_head(fh)
+    stream = PrefixReader(head, fh)
+    compression = "none"
+
+    for magic, name in MAGICS:
+        if head.startswith(magic):
+            compression = name
+
+    # the extra subfield "BC" of BGZF, it is inflated as gzip from a pipe
+    if compression == "gzip" and head[3:4] == b"\x04" and head[12:14] == b"BC":
+        compression = "bgzf"
+
+    if compression in ["gzip", "bgzf"]:
+        stream = gzip.GzipFile(fileobj=io.BufferedReader(stream, BLOCK_SIZE), mode="rb")
+    elif compression == "bz2":
+        stream = bz2.BZ2File(stream)
+    elif compression == "xz":
+        stream = lzma.LZMAFile(stream)
+
+    if compression != "none":
+        head = read_head(stream)
+        stream = PrefixReader(head, stream)
+
+    first = head.lstrip()[:1]
+
+    if first == b">":
+        fmt = "fasta"
+    elif first == b"@":
+        fmt = "fastq"
+    elif not first:
+        stream.close()
+        raise Exception("%r is empty" % filename)
+    else:
+        stream.close()
+        raise Exception("%r is not a fasta or fastq stream" % filename)
+
+    LOG.info("Read %r as a %s stream of %s" % (filename, compression, fmt))
+    _PIPE_STREAMS[key] = stream
+    _PIPE_FORMATS[key] = (compression, fmt)
+
+    return compression, fmt
+
+
+def open_pipe(filename):
+    """
+    return the sniffed stream of a pipe, see sniff_pipe
+    :param filename:
+    :return: a raw binary stream
+    """
+    key = get_pipe_key(filename)
+    sniff_pipe(filename)
+
+    if key not in _PIPE_STREAMS:
+        raise IOError("%r is read already, a pipe can be read only once" % filename)
+
+    return _PIPE_STREAMS.pop(key)
+
+
+def open_stream(filename, start=0, end=None, read_ahead=READ_AHEAD_DEPTH, size=READ_AHEAD_SIZE):
+    """
+    open a plain, gzip or BGZF file, or a pipe(see sniff_pipe) as a binary stream
+    :param filename:
+    :param start: the start offset, virtual offset for BGZF, not for gzip
+    :param end: the end offset, virtual offset for BGZF, not for gzip
+    :param read_ahead: the number of blocks read ahead in a thread for plain and gzip files, 0 to disable;
+                       BGZF files are inflated in their own threads
+    :param size: the size of blocks read ahead
+    :return: a binary stream object
+    """
+    if is_pipe(filename):
+        assert start == 0 and end is None, "byte ranges are not supported for %r" % filename
+        stream = open_pipe(filename)
+    elif filename.endswith(".gz") and is_bgzf(filename):
+        return io.BufferedReader(BgzfReader(filename, start, end), BLOCK_SIZE)
+    elif filename.endswith(".gz"):
+        assert start == 0 and end is None, "byte ranges are not supported for %r" % filename
+        stream = gzip.open(filename, "rb")
+    elif start or end is not None:
+        stream = RangeReader(open(filename, "rb"), start, end)
+    else:
+        stream = open(filename, "rb")
+
+    if read_ahead <= 0:
+        return io.BufferedReader(stream, BLOCK_SIZE) if isinstance(stream, (RangeReader, PrefixReader)) else stream
+
+    return io.BufferedReader(ReadAheadReader(stream, read_ahead, size), BLOCK_SIZE)
+
+
+class AtomicFile(io.FileIO):
+    """
+    write to a temporary file which is renamed to filename when closed,
+    a file dropped without close (e.g. by an exception) is removed, so
+    an output with the final name is always complete
+    """
+    def __init__(self, filename):
+        self._filename = filename
+        super(AtomicFile, self).__init__(filename + TMP_SUFFIX, "wb")
+
+    def close(self):
+        if self.closed:
+            return
+
+        size = self.tell()
+        super(AtomicFile, self).close()
+        os.replace(self.name, self._filename)
+        record_stage("write", calls=1, bytes_out=size)
+
+    def discard(self):
+        if self.closed:
+            return
+
+        super(AtomicFile, self).close()
+        os.remove(self.name)
+
+    def __del__(self):
+        self.discard()
+
+
+def compress_block(compress, data):
+    """
+    compress a block in a thread of ParallelWriter
+    :return: (compressed data, the cpu time of compression)
+    """
+    start = time.thread_time()
+    data = compress(data)
+
+    return data, time.thread_time() - start
+
+
+class ParallelWriter(io.RawIOBase):
+    """
+    compress large blocks of data in a thread pool and write them in order,
+    the writer is not blocked on compression
+    """
+    def __init__(self, filename, compress, block_size=BLOCK_SIZE, threads=1, trailer=b""):
+        self._fh = AtomicFile(filename)
+        self._compress = compress
+        self._block_size = block_size
+        self._threads = max(threads, 1)
+        self._trailer = trailer
+        self._pool = ThreadPoolExecutor(self._threads)
+        self._pending = deque()
+        self._buf = bytearray()
+        # the bytes before and after compression, the cpu time of compression
+        # and the time the writer waited for it
+        self._stats = {"bytes_in": 0, "bytes_out": 0, "cpu": 0.0, "wall": 0.0}
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._buf += b
+
+        if len(self._buf) >= self._block_size:
+            size = len(self._buf) // self._block_size * self._block_size
+            self._submit(bytes(self._buf[:size]))
+            del self._buf[:size]
+
+        return len(b)
+
+    def _submit(self, data):
+        self._stats["bytes_in"] += len(data)
+        self._pending.append(self._pool.submit(compress_block, self._compress, data))
+
+        # bound the memory of queued blocks
+        while len(self._pending) > 2 * self._threads:
+            self._write_next()
+
+    def _write_next(self):
+        start = time.time()
+        data, cpu = self._pending.popleft().result()
+        self._stats["wall"] += time.time() - start
+        self._stats["cpu"] += cpu
+        self._stats["bytes_out"] += len(data)
+        self._fh.write(data)
+
+    def close(self):
+        if self.closed:
+            return
+
+        try:
+            if self._buf:
+                self._submit(bytes(self._buf))
+            while self._pending:
+                self._write_next()
+            self._fh.write(self._trailer)
+        except BaseException:
+            self._fh.discard()
+            raise
+        else:
+            record_stage("compress", calls=1, **self._stats)
+        finally:
+            self._pool.shutdown()
+            self._fh.close()
+            super(ParallelWriter, self).close()
+
+    def __del__(self):
+        if not self.closed:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._fh.discard()
+            super(ParallelWriter, self).close()
+
+
+def open_output(filename, compress="none", level=6, threads=1):
+    """
+    open an output binary stream, the output is written to a temporary
+    file and renamed to filename when closed, see AtomicFile
+    :param filename:
+    :param compress: none, gzip or bgzf
+    :param level: compression level
+    :param threads: the number of compression threads
+    :return:
+    """
+    if compress == "gzip":
+        # concatenated gzip members are a valid gzip file
+        return ParallelWriter(filename, partial(gzip.compress, compresslevel=level, mtime=0), threads=threads)
+    elif compress == "bgzf":
+        return ParallelWriter(filename, partial(deflate_blocks, level=level),
+                              block_size=64 * MAX_BLOCK_DATA, threads=threads, trailer=BGZF_EOF)
+    else:
+        return AtomicFile(filename)
+
+
+def split_ranges(filename, parts, find_start, min_size=MIN_RANGE_SIZE):
+    """
+    cut an uncompressed or BGZF file into byte ranges aligned to record boundaries
+    :param filename:
+    :param parts: the max number of ranges
+    :param find_start: function(stream, offset) return the offset of the first record at or after offset
+    :param min_size: the min size of a range
+    :return: a list of (start, end)
+    """
+    if filename.endswith(".gz") and is_bgzf(filename):
+        return split_bgzf_ranges(filename, parts, find_start, min_size)
+    elif filename.endswith(".gz"):
+        return [(0, None)]
+
+    size = os.path.getsize(filename)
+    parts = max(min(parts, size // min_size), 1)
+    offsets = [0]
+
+    with open(filename, "rb") as fh:
+        for i in range(1, parts):
+            offset = find_start(fh, size * i // parts)
+            if offsets[-1] < offset < size:
+                offsets.append(offset)
+
+    offsets.append(size)
+
+    return list(zip(offsets[:-1], offsets[1:]))
+
+
+def split_bgzf_ranges(filename, parts, find_start, min_size=MIN_RANGE_SIZE):
+    """
+    cut a BGZF file into ranges of virtual offsets aligned to record boundaries,
+    the compressed file is cut at blocks and then realigned in the inflated data
+    :param filename:
+    :param parts: the max number of ranges
+    :param find_start: see split_ranges
+    :param min_size: the min size of a compressed range
+    :return: a list of (start, end), the end of the last range is None
+    """
+    size = os.path.getsize(filename)
+    parts = max(min(parts, size // min_size), 1)
+    offsets = [0]
+
+    with open(filename, "rb") as fh:
+        for i in range(1, parts):
+            block = find_block(fh, size * i // parts, size)
+            if block >= size:
+                continue
+
+            offset = sync_bgzf(filename, block, find_start)
+            if offset is not None and offset > offsets[-1]:
+                offsets.append(offset)
+
+    return list(zip(offsets, offsets[1:] + [None]))
+
+
+def sync_bgzf(filename, block, find_start):
+    """
+    find the virtual offset of the first record after the start of a block
+    :param filename:
+    :param block: the offset of block
+    :param find_start: see split_ranges
+    :return: None if not found
+    """
+    reader = BgzfReader(filename, block << 16, threads=1)
+
+    try:
+        # the data before the first line start is part of the previous range
+        pos = find_start(reader, 1)
+
+        # find_start returns the end of data if not found
+        if pos < reader.tell():
+            return reader.voffset(pos)
+        return None
+    finally:
+        reader.close()
+
+
+def binary_stream(stream):
+    """
+    return the binary buffer under a text stream, or the stream itself
+    :param stream: a stream object
+    :return:
+    """
+    return getattr(stream, "buffer", stream)
+
+
+def read_blocks(stream, size=BLOCK_SIZE):
+    """
+    yield large binary blocks from stream
+    :param stream: a binary stream object
+    :param size: the size of each block
+    :return:
+    """
+    while True:
+        block = stream.read(size)
+
+        if not block:
+            break
+
+        yield block
+
+
+def sync_blocks(fh, offset, size=SYNC_SIZE):
+    """
+    yield the blocks read from the byte before offset, used to realign an
+    offset to a record boundary; each block is yielded once, the caller
+    keeps what it needs of the previous blocks, so a search is linear
+    :param fh: a binary file object, a stream not seekable is read from its current position
+    :param offset:
+    :param size:
+    :return: (the offset of block, block, end of file or not)
+    """
+    start = max(offset - 1, 0)
+
+    if fh.seekable():
+        fh.seek(start)
+
+    while True:
+        block = fh.read(size)
+        yield start, block, not block
+
+        if not block:
+            break
+
+        start += len(block)